@@ -1,9 +1,12 @@
-from game import Game
+from game import Game, GameStatus
 from entity import Soldier, Rider, Lancer, Knight, Warrior, Swordsman, Barbarian, \
-    Spearman, King, Position, PlayerMove, Move, Skill, SkillSet, PositionDelta
-from const import player_1, player_2
-from board import Board
+    Spearman, King, Position, PlayerMove, Move, Skill, SkillSet, PositionDelta, ActionType, duel_table
+from const import player_1, player_2, board_size, skillset_size, skillset_range
+from board import Board, set_out, skill_targets, battle_winner
 import rule
+import vectorized
+import itertools
+import random
 
 player_color = {
     player_1: "LIGHTMAGENTA_EX",
@@ -15,12 +18,127 @@ player_name = {
     player_2: 'zc'
 }
 
+def assert_square_view():
+    for square in range(board_size):
+        assert(Position.from_square(square).square == square)
+
+    b = Board()
+    set_out(b)
+    squares = []
+    b.iterate_units(lambda u, square: squares.append(square))
+    assert(squares[0] == Position(0, 0).square)
+    assert(all(type(s) is int for s in squares))
+
+    move = Move.from_literal("4443")
+    assert(move.square_from == Position(4, 4).square)
+    assert(move.position_to == Position(4, 3))
+    assert(str(move) == '55->54')
+
+def assert_skillset():
+    skills = [Skill(PositionDelta(-2, 1)), Skill(PositionDelta(0, -2)), Skill(PositionDelta(1, 0))]
+    s = SkillSet(skills)
+    assert(all(s.has(skill) for skill in skills))
+    assert(not s.has(Skill(PositionDelta(0, 2))))
+    assert([skill.index() for skill in s.list_skills()] == sorted(skill.index() for skill in skills))
+
+    flipped = s.copy()
+    flipped.flip()
+    assert(flipped.has(Skill(PositionDelta(-2, -1))) and flipped.has(Skill(PositionDelta(0, 2))))
+    assert(flipped.has(Skill(PositionDelta(1, 0))) and len(flipped.list_skills()) == 3)
+    flipped.flip()
+    assert(flipped == s)
+
+    assert(s.copy().subtract(SkillSet(skills[:2])) == SkillSet(skills[2:]))
+    assert(SkillSet(skills[:1]).union(SkillSet(skills[1:])) == s)
+    assert(SkillSet.deserialize(s.serialize()) == s)
+
+    b = Board()
+    set_out(b)
+    b.put(Position(4, 4).square, Rider(player_1).endow(Skill(PositionDelta(-1, -2))))
+    c = Board.deserialize(b.serialize())
+    assert(c.board == b.board and c.hash() == b.hash())
+
+def assert_skill_targets():
+    for square in range(board_size):
+        position = Position.from_square(square)
+        for index in range(skillset_size ** 2):
+            dx, dy = divmod(index, skillset_size)
+            delta = PositionDelta(dx - skillset_range, dy - skillset_range)
+            target = position.get_new_position(delta)
+            expected = None if target is None else target.square
+            assert(skill_targets[square][index] == expected)
+
+def assert_bitboards():
+    b = Board()
+    set_out(b)
+    assert(rule.count_unit(b, player_1) == 18)
+    assert(rule.count_unit(b, player_2, Soldier) == 4)
+    assert(rule.find_unit(b, King, player_1) == Position(4, 8).square)
+
+    b.remove(Position(4, 8).square)
+    b.put(Position(4, 4).square, King(player_1))
+    b.put(Position(0, 1).square, Soldier(player_1))
+    assert(rule.count_unit(b, player_1) == 19)
+    assert(rule.count_unit(b, player_2) == 17)
+    assert(rule.find_unit(b, King, player_1) == Position(4, 4).square)
+    assert(b.king_square[player_1] == Position(4, 4).square)
+    assert(b.king_square[player_2] == Position(4, 0).square)
+    b.copy().remove(Position(4, 0).square)
+    assert(rule.status(b) == 0)
+    b.remove(Position(4, 0).square)
+    assert(b.king_square[player_2] is None)
+    assert(rule.status(b) == 1)
+
+    squares = []
+    b.iterate_units(lambda u, square: squares.append(square), player_2)
+    assert(len(squares) == 16 and all(b.at(s).owner == player_2 for s in squares))
+    assert(rule.is_king_side(b, player_1, Position(4, 3).square))
+    assert(not rule.is_king_side(b, player_1, Position(3, 3).square))
+
+    for player in [player_1, player_2]:
+        mask = 0
+        def each(u, square):
+            nonlocal mask
+            if u.owner == player:
+                for target in rule.reachable_positions(b, square):
+                    mask |= 1 << target
+        b.iterate_units(each)
+        assert(b.attack_mask(player) == mask)
+
+def assert_zobrist():
+    b = Board()
+    assert(b.hash() == 0)
+    set_out(b)
+
+    c = Board()
+    for square in reversed(range(board_size)):
+        if b.at(square) is not None:
+            c.put(square, b.at(square))
+    assert(c.hash() == b.hash())
+
+    p = Position.from_literal('52').square
+    c.put(p, Soldier(player_2))
+    assert(c.hash() != b.hash())
+    c.put(p, Barbarian(player_1))
+    assert(c.hash() != b.hash())
+    c.put(p, Barbarian(player_2))
+    assert(c.hash() == b.hash())
+
+    upgraded = b.at(p).endow(Skill(PositionDelta(1, -1)))
+    c.put(p, upgraded)
+    assert(c.hash() != b.hash())
+
+    g = Game(b)
+    assert(g.hash() == Game(b.copy()).hash() != Game(c).hash())
+    g.replenish(1)
+    assert(g.hash() != Game(b).hash())
+
 def assert_input():
     b = Board()
-    b.put(Position(4, 3), Soldier(player_1))
-    b.put(Position(4, 2), Soldier(player_1))
-    b.put(Position(4, 4), Soldier(player_2))
-    b.put(Position(4, 5), Soldier(player_2))
+    b.put(Position(4, 3).square, Soldier(player_1))
+    b.put(Position(4, 2).square, Soldier(player_1))
+    b.put(Position(4, 4).square, Soldier(player_2))
+    b.put(Position(4, 5).square, Soldier(player_2))
     g = Game(b)
     g.replenish(100)
 
@@ -32,8 +150,8 @@ def assert_input():
 def assert_invalid_input():
     b = Board()
 
-    b.put(Position(4, 3), Soldier(player_1))
-    b.put(Position(4, 4), Soldier(player_2))
+    b.put(Position(4, 3).square, Soldier(player_1))
+    b.put(Position(4, 4).square, Soldier(player_2))
 
     g = Game(b)
     g.replenish(100)
@@ -47,14 +165,14 @@ def assert_invalid_input():
 
 def assert_clash():
     b = Board()
-    p1p = Position(4, 3)
-    p1p2 = Position(5, 6)
-    p2p = Position(4, 4)
+    p1p = Position(4, 3).square
+    p1p2 = Position(5, 6).square
+    p2p = Position(4, 4).square
     s = Spearman(player_1, SkillSet())
-    s.endow(Skill(PositionDelta(0, 1)))
+    s = s.endow(Skill(PositionDelta(0, 1)))
     b.put(p1p, s)
     r = Rider(player_1)
-    r.endow(Skill(PositionDelta(-1, -2)))
+    r = r.endow(Skill(PositionDelta(-1, -2)))
     b.put(p1p2, r)
     b.put(p2p, Soldier(player_2))
     g = Game(b)
@@ -68,14 +186,28 @@ def assert_clash():
     assert(type(g.board.at(p1p)) == Spearman)
     assert(type(g.board.at(p2p)) == Rider)
 
+def assert_duel_table():
+    assert(Knight(player_1, SkillSet()).duel(Soldier(player_2)).owner == player_1)
+    assert(Soldier(player_1).duel(Warrior(player_2, SkillSet())).owner == player_2)
+    assert(Swordsman(player_1, SkillSet()).duel(Spearman(player_2, SkillSet())) is None)
+    assert(all(
+        (duel_table[first, second] > 0) == (first.level > second.level)
+        and duel_table[first, second] == -duel_table[second, first]
+        for first, second in duel_table))
+
+    assert(battle_winner(2, 1, -1) == player_1)
+    assert(battle_winner(0, 1, 1) == player_2)
+    assert(battle_winner(1, 1, 1) == player_1)
+    assert(battle_winner(0, 0, 0) is None)
+
 def assert_move_conflict():
     b = Board()
-    p1p1 = Position(4, 2)
-    p2p1 = Position(4, 4)
+    p1p1 = Position(4, 2).square
+    p2p1 = Position(4, 4).square
 
-    p1p2 = Position(5, 2)
-    p1p3 = Position(6, 1)
-    p2p2 = Position(5, 4)
+    p1p2 = Position(5, 2).square
+    p1p3 = Position(6, 1).square
+    p2p2 = Position(5, 4).square
 
     b.put(p1p1, Soldier(player_1))
     b.put(p2p1, Soldier(player_2))
@@ -94,19 +226,19 @@ def assert_move_conflict():
     assert(g.board.at(p1p2) is None)
     assert(g.board.at(p1p3) is not None)
     assert(g.board.at(p2p2) is None)
-    assert(g.board.at(Position(5, 3)).owner == player_1)
+    assert(g.board.at(Position(5, 3).square).owner == player_1)
 
 def assert_attack_defend():
     b = Board()
-    p2u1 = Position.from_literal('55')
-    p2u2 = Position.from_literal('66')
-    p2u3 = Position.from_literal('61')
+    p2u1 = Position.from_literal('55').square
+    p2u2 = Position.from_literal('66').square
+    p2u3 = Position.from_literal('61').square
 
-    p1u1 = Position.from_literal('54')
-    p1u2 = Position.from_literal('53')
-    p1u3 = Position.from_literal('62')
-    p1u4 = Position.from_literal('67')
-    p1u5 = Position.from_literal('56')
+    p1u1 = Position.from_literal('54').square
+    p1u2 = Position.from_literal('53').square
+    p1u3 = Position.from_literal('62').square
+    p1u4 = Position.from_literal('67').square
+    p1u5 = Position.from_literal('56').square
 
     b.put(p2u1, Soldier(player_2))
     b.put(p2u2, make_perfect(Rider(player_2)))
@@ -135,25 +267,25 @@ def assert_attack_defend():
     assert(g.board.at(p1u4) is None)
     assert(g.board.at(p1u5) is None)
 
-    assert(g.board.at(Position.from_literal('46')).owner == player_1)
+    assert(g.board.at(Position.from_literal('46').square).owner == player_1)
 
 def make_perfect(unit):
     for s in unit.perfect_skillset.list_skills():
-        unit.endow(s)
+        unit = unit.endow(s)
     return unit
 
 def assert_buffs():
     b = Board()
 
-    b.put(Position.from_literal('55'), make_perfect(Lancer(player_1, SkillSet())))
-    b.put(Position.from_literal('66'), make_perfect(Knight(player_1, SkillSet())))
-    b.put(Position.from_literal('46'), make_perfect(Knight(player_1, SkillSet())))
-    b.put(Position.from_literal('68'), make_perfect(Warrior(player_2, SkillSet())))
-    b.put(Position.from_literal('78'), make_perfect(Spearman(player_1, SkillSet())))
-    b.put(Position.from_literal('88'), make_perfect(Spearman(player_1, SkillSet())))
-    b.put(Position.from_literal('53'), make_perfect(Soldier(player_1)))
-    b.put(Position.from_literal('52'), make_perfect(Soldier(player_2)))
-    b.put(Position.from_literal('59'), Swordsman(player_1, SkillSet()))
+    b.put(Position.from_literal('55').square, make_perfect(Lancer(player_1, SkillSet())))
+    b.put(Position.from_literal('66').square, make_perfect(Knight(player_1, SkillSet())))
+    b.put(Position.from_literal('46').square, make_perfect(Knight(player_1, SkillSet())))
+    b.put(Position.from_literal('68').square, make_perfect(Warrior(player_2, SkillSet())))
+    b.put(Position.from_literal('78').square, make_perfect(Spearman(player_1, SkillSet())))
+    b.put(Position.from_literal('88').square, make_perfect(Spearman(player_1, SkillSet())))
+    b.put(Position.from_literal('53').square, make_perfect(Soldier(player_1)))
+    b.put(Position.from_literal('52').square, make_perfect(Soldier(player_2)))
+    b.put(Position.from_literal('59').square, Swordsman(player_1, SkillSet()))
 
     g = Game(b)
     g = g.make_move([
@@ -162,16 +294,161 @@ def assert_buffs():
 
     assert(g.supply[player_1] == 29) # 40 - 16 + 5
 
+def assert_game_cache():
+    b = Board()
+    set_out(b)
+    g = Game(b)
+
+    buff = g.get_buff_board()
+    heat = g.get_heat_board()
+    g.validate_player_move(PlayerMove.from_literal(player_1, ""))
+    assert(g.get_buff_board() is buff and g.get_heat_board() is heat)
+
+    p = Position.from_literal('65').square
+    b.put(p, make_perfect(Spearman(player_1, SkillSet())))
+    assert(g.get_buff_board() is not buff)
+    assert(g.get_buff_board().at(p).get(ActionType.Attack) == -1)
+    assert(g.get_heat_board() is not heat)
+
+    b.remove(p)
+    buff = g.get_buff_board()
+    g.board = b.copy()
+    assert(g.get_buff_board() is not buff)
+
+    g.make_move([PlayerMove.from_literal(player_1, ""), PlayerMove.from_literal(player_2, "")])
+    assert(len(g.cache) == 0)
+
+def assert_incremental_heat():
+    rule.check_heat = True
+    try:
+        g = Game()
+        g.get_heat_board()
+        rng = random.Random(13)
+        for _ in range(40):
+            if g.get_status() != GameStatus.Ongoing:
+                break
+            g = g.make_move([g.random_player_move(player, rng) for player in [player_1, player_2]])
+            heat = g.cached_value('heat_board')
+            assert(heat is not None and g.get_heat_board() is heat)
+    finally:
+        rule.check_heat = False
+
+    assert(Game().make_move([
+        PlayerMove.from_literal(player_1, ""),
+        PlayerMove.from_literal(player_2, "")]).cached_value('heat_board') is None)
+
+def assert_vectorized():
+    if not vectorized.available:
+        return
+
+    b = Board()
+    set_out(b)
+    b.put(Position.from_literal('55').square, make_perfect(Lancer(player_1, SkillSet())))
+    b.put(Position.from_literal('46').square, make_perfect(Knight(player_1, SkillSet())))
+    b.put(Position.from_literal('54').square, make_perfect(Warrior(player_2, SkillSet())))
+    b.put(Position.from_literal('65').square, make_perfect(Swordsman(player_1, SkillSet())))
+    b.put(Position.from_literal('33').square, make_perfect(Spearman(player_2, SkillSet())))
+
+    buff = rule.get_buff_board(b)
+    assert(buff.at(Position.from_literal('65').square).get(ActionType.Upgrade) == -2)
+    for board in [b, Board()]:
+        assert(all(
+            vectorized.get_heat_board(board).heat(square, player) == 
+                rule.get_heat_board(board).heat(square, player)
+            for square in range(board_size) for player in [player_1, player_2]))
+        assert(all(
+            vectorized.get_buff_board(board).at(square).map == 
+                rule.get_buff_board(board).at(square).map
+            for square in range(board_size)))
+
+def assert_copy_on_write():
+    b = Board()
+    p = Position.from_literal('55').square
+    b.put(p, Soldier(player_1))
+    g = Game(b)
+    g.replenish(100)
+
+    unit = b.at(p)
+    c = b.copy()
+    assert(c.at(p) is unit)
+    assert(c.board is b.board)
+    c.remove(p)
+    assert(c.board is not b.board)
+    assert(b.at(p) is unit and c.at(p) is None)
+
+    g = g.make_move([
+        PlayerMove.from_literal(player_1, "4454"),
+        PlayerMove.from_literal(player_2, "")])
+
+    assert(b.at(p) is unit)
+    assert(not unit.has_skill(Skill(PositionDelta(1, 0))))
+    assert(g.board.at(p).has_skill(Skill(PositionDelta(1, 0))))
+
+def assert_flyweight_units():
+    soldier = Soldier(player_1)
+    assert(soldier is Soldier(player_1))
+    assert(soldier.perfect_skillset is Soldier(player_2).perfect_skillset)
+    assert(soldier.skillset is Soldier.inborn_skillset[player_1])
+    assert(soldier is not Soldier(player_2))
+
+    right = Skill(PositionDelta(1, 0))
+    upgraded = soldier.endow(right)
+    assert(upgraded is not soldier and not soldier.has_skill(right))
+    assert(upgraded is soldier.endow(right) is upgraded.endow(right))
+    assert(soldier.endow(Skill(PositionDelta(2, 0))) is None)
+
+    perfect = make_perfect(Soldier(player_1))
+    assert(perfect is make_perfect(Soldier(player_1)))
+    assert(type(perfect.get_promoted(Skill(PositionDelta(0, 2)))) == Spearman)
+
+    assert(perfect.ultimate_skillset() is perfect.ultimate_skillset())
+    assert(perfect.has_potential_skill(Skill(PositionDelta(0, 2))))
+    assert(not perfect.has_potential_skill(Skill(PositionDelta(1, 0))))
+    assert(soldier.has_potential_skill(Skill(PositionDelta(1, 0))))
+    assert(not soldier.ultimate_skillset().has(Skill(PositionDelta(0, 2))))
+
+def assert_apply_undo_round():
+    b = Board()
+    b.put(Position.from_literal('55').square, make_perfect(Soldier(player_1)))
+    b.put(Position.from_literal('45').square, Soldier(player_1))
+    b.put(Position.from_literal('44').square, Soldier(player_2))
+    b.put(Position.from_literal('59').square, King(player_1))
+    b.put(Position.from_literal('51').square, King(player_2))
+    serialized, hashed = b.serialize(), b.hash()
+
+    player_actions = [
+        rule.validate_player_move(b, PlayerMove.from_literal(player_1, "4442 3433 0807")),
+        rule.validate_player_move(b, PlayerMove.from_literal(player_2, "3334 4050"))]
+    assert(str(player_actions[0]) == '55->53(UPG),45->44(ATK),19->18(RCR)')
+
+    cells = b.board
+    record = rule.apply_round(b, player_actions)
+    assert(b.board is cells)
+    assert(type(b.at(Position.from_literal('55').square)) == Spearman)
+    assert(len(record.martyr_list) == 2)
+    assert(type(b.at(Position.from_literal('19').square)) == Soldier)
+    assert(b.hash() != hashed)
+
+    rule.undo_round(b, record)
+    assert(b.board is cells)
+    assert(b.serialize() == serialized)
+    assert(b.hash() == hashed)
+    assert(rule.count_unit(b, player_1) == 3)
+    assert(b.king_square[player_1] == Position.from_literal('59').square)
+    rebuilt = Board()
+    b.iterate_units(lambda unit, square: rebuilt.put(square, unit))
+    assert(b.occupancy == rebuilt.occupancy and b.skill_planes == rebuilt.skill_planes)
+
 def assert_recall():
     b = Board()
 
-    b.put(Position.from_literal('55'), King(player_1))
-    b.put(Position.from_literal('57'), make_perfect(Soldier(player_2, SkillSet())))
+    b.put(Position.from_literal('55').square, King(player_1))
+    b.put(Position.from_literal('57').square, make_perfect(Soldier(player_2, SkillSet())))
 
-    b.put(Position.from_literal('88'), make_perfect(Soldier(player_2, SkillSet())))
-    b.put(Position.from_literal('89'), make_perfect(Lancer(player_1, SkillSet())))
+    b.put(Position.from_literal('88').square, make_perfect(Soldier(player_2, SkillSet())))
+    b.put(Position.from_literal('89').square, make_perfect(Lancer(player_1, SkillSet())))
 
-    b.put(Position.from_literal('11'), make_perfect(Lancer(player_1, SkillSet())))
+    b.put(Position.from_literal('11').square, make_perfect(Lancer(player_1, SkillSet())))
     
     g = Game(b)
     try:
@@ -196,13 +473,227 @@ def assert_recall():
         PlayerMove.from_literal(player_1, "5400"),
         PlayerMove.from_literal(player_2, "")])
     
-    assert(g.board.at(Position.from_literal('11')) is None)
-    assert(g.board.at(Position.from_literal('65')).owner == player_1)
+    assert(g.board.at(Position.from_literal('11').square) is None)
+    assert(g.board.at(Position.from_literal('65').square).owner == player_1)
+
+def assert_validate_many():
+    b = Board()
+    b.put(Position.from_literal('55').square, King(player_1))
+    b.put(Position.from_literal('57').square, make_perfect(Soldier(player_2, SkillSet())))
+    b.put(Position.from_literal('11').square, make_perfect(Lancer(player_1, SkillSet())))
+    b.put(Position.from_literal('89').square, Soldier(player_1))
+
+    player_move_list = [
+        PlayerMove.from_literal(player_1, literal) for literal in 
+        ["5400", "4500", "5478", "0001", "7877", "7868 7877", "", "5400 4444"]]
+    context = rule.ValidationContext(b)
+    results = rule.validate_many(b, player_move_list, context)
+    assert(str(results[0]) == '65->11(RCL)')
+    assert(str(results[1]) == 'recall destination is under attack')
+
+    for player_move, result in zip(player_move_list, results):
+        try:
+            expected = rule.validate_player_move(b, player_move)
+        except rule.InvalidMoveException as e:
+            assert(type(result) is rule.InvalidMoveException and str(result) == str(e))
+        else:
+            assert(str(result) == str(expected))
 
+    g = Game(b)
+    assert(g.get_validation_context() is g.get_validation_context())
+    assert(g.get_buff_board() is g.get_validation_context().buff_board())
+
+def assert_legal_actions():
+    recall_board = Board()
+    recall_board.put(Position.from_literal('55').square, King(player_1))
+    recall_board.put(Position.from_literal('57').square, make_perfect(Soldier(player_2, SkillSet())))
+    recall_board.put(Position.from_literal('11').square, make_perfect(Lancer(player_1, SkillSet())))
+    recall_board.put(Position.from_literal('59').square, make_perfect(Knight(player_1, SkillSet())))
+    recall_board.put(Position.from_literal('68').square, Swordsman(player_1, SkillSet()))
+
+    opening = Board()
+    set_out(opening)
+    g = Game(opening)
+    g.replenish(100)
+    player_move_list = []
+    for player in [player_1, player_2]:
+        moves = {}
+        for action, _ in rule.legal_actions(opening, player):
+            if action.type == ActionType.Move:
+                moves[action.move.square_from] = action.move
+        player_move_list.append(PlayerMove(player, list(moves.values())[:4]))
+    g = g.make_move(player_move_list)
+
+    for b in [opening, g.board, recall_board]:
+        buff_board = rule.get_buff_board(b)
+        for player in [player_1, player_2]:
+            legal = set()
+            for action, cost in rule.legal_actions(b, player):
+                assert(cost == action.get_cost(buff_board))
+                legal.add(str(action))
+
+            expected = set()
+            for square_from in range(board_size):
+                for square_to in range(board_size):
+                    try:
+                        action = rule.validate_move(b, Move(square_from, square_to), player)
+                    except rule.InvalidMoveException:
+                        continue
+                    expected.add(str(action))
+            assert(legal == expected)
+
+    assert('65->11(RCL)' in set(str(action) for action, _ in rule.legal_actions(recall_board, player_1)))
+
+def assert_affordable_player_moves():
+    b = Board()
+    b.put(Position.from_literal('55').square, King(player_1))
+    b.put(Position.from_literal('57').square, Soldier(player_2))
+    b.put(Position.from_literal('54').square, Soldier(player_1))
+    b.put(Position.from_literal('44').square, Soldier(player_1))
+    g = Game(b)
+    g.supply[player_1] = 5
+
+    options = {}
+    for action, cost in rule.legal_actions(b, player_1):
+        if cost <= g.supply[player_1]:
+            options.setdefault(action.move.square_from, [None]).append((cost, action.move))
+    expected = set()
+    for combination in itertools.product(*options.values()):
+        chosen = [option for option in combination if option is not None]
+        if sum(cost for cost, _ in chosen) <= g.supply[player_1]:
+            expected.add(str(PlayerMove(player_1, [move for _, move in chosen])))
+
+    yielded = [str(player_move) for player_move in g.affordable_player_moves(player_1)]
+    assert(len(yielded) == len(set(yielded)) and set(yielded) == expected)
+
+    sampled = list(g.affordable_player_moves(player_1, limit=20, rng=random.Random(7)))
+    assert(len(sampled) == 20)
+    for player_move in sampled:
+        g.validate_player_move(player_move)
+        assert(str(PlayerMove(player_1, sorted(player_move.move_list, key=lambda move: move.square_from))) in expected)
+    assert(len(set(str(player_move) for player_move in sampled)) > 1)
+    assert(len(list(g.affordable_player_moves(player_1, limit=0))) == 0)
+    endless = g.affordable_player_moves(player_1, rng=random.Random(7))
+    assert([str(player_move) for player_move in itertools.islice(endless, 20)] == [str(player_move) for player_move in sampled])
+
+def assert_playout():
+    g = Game()
+    rng = random.Random(3)
+    for _ in range(30):
+        g = g.make_move([g.random_player_move(player, rng) for player in [player_1, player_2]])
+
+    rng = random.Random(9)
+    expected = g.make_move([g.random_player_move(player, rng) for player in [player_1, player_2]])
+    assert(g.playout(1, random.Random(9)).hash() == expected.hash())
+    legal = set(str(action) for action, _ in rule.legal_actions(g.board, player_1))
+    for action in g.random_player_action(player_1, random.Random(4)).action_list:
+        assert(str(action) in legal)
+
+    g = Game().playout(200, random.Random(5))
+    assert(g.round_count == 200 or g.get_status() != GameStatus.Ongoing)
+    assert(g.supply[player_1] >= 0 and g.supply[player_2] >= 0)
+
+def assert_batched_rounds():
+    if not vectorized.available:
+        return
+
+    b = Board()
+    b.put(Position(4, 3).square, Spearman(player_1, SkillSet()).endow(Skill(PositionDelta(0, 1))))
+    b.put(Position(5, 6).square, Rider(player_1).endow(Skill(PositionDelta(-1, -2))))
+    b.put(Position(4, 4).square, Soldier(player_2))
+    boards = [b]
+    player_actions_list = [[
+        rule.validate_player_move(b, PlayerMove.from_literal(player_2, "4443")),
+        rule.validate_player_move(b, PlayerMove.from_literal(player_1, "5644 4344"))]]
+
+    rng = random.Random(11)
+    for _ in range(8):
+        g = Game()
+        for _ in range(25):
+            if g.get_status() != GameStatus.Ongoing:
+                break
+            boards.append(g.board)
+            player_actions_list.append([
+                g.random_player_action(player, rng) for player in rng.sample([player_1, player_2], 2)])
+            g = g.playout(1, rng)
+
+    def martyr_keys(martyr_list):
+        return sorted(
+            (martyr.board_unit.square, id(martyr.board_unit.unit), martyr.has_trophy)
+            for martyr in martyr_list)
+
+    next_boards, martyr_lists = vectorized.apply_rounds(boards, player_actions_list, batch_size=16)
+    for board, player_actions, next_board, martyr_list in zip(
+            boards, player_actions_list, next_boards, martyr_lists):
+        expected = board.copy()
+        record = rule.apply_round(expected, player_actions)
+        assert(next_board.board == expected.board and next_board.hash() == expected.hash())
+        assert(martyr_keys(martyr_list) == martyr_keys(record.martyr_list))
+
+    assert(type(next_boards[0].at(Position(4, 4).square)) == Rider)
+
+def assert_validation_memo():
+    b = Board()
+    set_out(b)
+    memo = rule.ValidationMemo(capacity=4)
+    move = next(action.move for action, _ in rule.legal_actions(b, player_1)
+        if action.type == ActionType.Move)
+    player_move = PlayerMove(player_1, [move])
+
+    for _ in range(3):
+        player_action = memo.validate_player_move(b, player_move)
+        assert(str(player_action) == str(rule.validate_player_move(b, player_move)))
+        assert(player_action.action_list[0].move is move)
+    assert(memo.misses == 1 and memo.hits == 2)
+
+    for _ in range(2):
+        try:
+            memo.validate_move(b, Move(40, 40), player_1)
+        except rule.InvalidMoveException as e:
+            assert(str(e) == "grid is empty")
+        else:
+            raise Exception()
+    assert(memo.misses == 2 and memo.hits == 3)
+
+    b.remove(move.square_from)
+    b.put(move.square_from, Soldier(player_2))
+    try:
+        memo.validate_player_move(b, player_move)
+    except rule.InvalidMoveException as e:
+        assert(str(e) == "grid belongs to enemy")
+    else:
+        raise Exception()
+    assert(memo.misses == 3)
+
+    for square in range(5):
+        try:
+            memo.validate_move(b, Move(square, square), player_2)
+        except rule.InvalidMoveException:
+            pass
+    assert(len(memo.entries) == 4)
+
+assert_square_view()
+assert_skillset()
+assert_skill_targets()
+assert_bitboards()
+assert_zobrist()
 assert_input()
 assert_invalid_input()
 assert_clash()
+assert_duel_table()
 assert_move_conflict()
 assert_attack_defend()
 assert_buffs()
-assert_recall()
\ No newline at end of file
+assert_game_cache()
+assert_incremental_heat()
+assert_vectorized()
+assert_copy_on_write()
+assert_flyweight_units()
+assert_apply_undo_round()
+assert_recall()
+assert_validate_many()
+assert_legal_actions()
+assert_affordable_player_moves()
+assert_playout()
+assert_batched_rounds()
+assert_validation_memo()
\ No newline at end of file
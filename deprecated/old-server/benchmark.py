@@ -0,0 +1,337 @@
+from game import Game, GameStatus
+from board import Board, set_out
+from entity import Move, PlayerMove, Unit, SkillSet
+from const import player_1, player_2, board_size, board_size_y
+import rule
+import vectorized
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+def random_player_move(game, player, rng):
+    candidates = []
+    def each(u, square):
+        if u.owner == player:
+            for target in rule.reachable_positions(game.board, square, True):
+                candidates.append(Move(square, target))
+    game.board.iterate_units(each)
+    for square in range(board_size):
+        if square % board_size_y == rule.spawn_row[player]:
+            candidates.append(Move(square, square))
+    rng.shuffle(candidates)
+
+    move_list = []
+    for move in candidates:
+        if rng.random() < 0.5:
+            continue
+        try:
+            game.validate_player_move(PlayerMove(player, move_list + [move]))
+        except rule.InvalidMoveException:
+            continue
+        move_list.append(move)
+    return PlayerMove(player, move_list)
+
+def record_session(rounds, seed=0):
+    rng = random.Random(seed)
+    session = []
+    game = Game()
+    while len(session) < rounds:
+        if game.get_status() != GameStatus.Ongoing:
+            game = Game()
+        player_move_list = [
+            random_player_move(game, player_1, rng),
+            random_player_move(game, player_2, rng)]
+        session.append((game, player_move_list))
+        game = game.make_move(player_move_list)
+    return session
+
+def time_rounds(session, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for game, player_move_list in session:
+            game.make_move(player_move_list)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(session)
+
+# recorded on the tree before this series, where Board.copy was a deepcopy
+# and every Unit owned its skillsets, over record_session(100)
+pre_series_make_move_seconds = 4500e-6
+pre_series_history_bytes = 83.2 * 1024
+
+def bench_make_move(rounds=100):
+    after = time_rounds(record_session(rounds))
+    print(f'Game.make_move per round: {after * 1e6:.0f}us '
+        f'(pre-series {pre_series_make_move_seconds * 1e6:.0f}us, {pre_series_make_move_seconds / after:.1f}x)')
+
+# replays session as one make_move chain from fresh games, the way ServerGame.next
+# builds it, and keeps every game like ServerGame.server_game_map does
+def replay_chain(session):
+    history = []
+    for game, player_move_list in session:
+        if game.round_count == 0:
+            current = Game()
+            history.append(current)
+        current = current.make_move(player_move_list)
+        history.append(current)
+    return history
+
+def history_memory(session):
+    tracemalloc.start()
+    history = replay_chain(session)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(session)
+
+def bench_history_memory(rounds=100):
+    after = history_memory(record_session(rounds))
+    print(f'Game history retained per round: {after / 1024:.1f}KiB '
+        f'(pre-series {pre_series_history_bytes / 1024:.1f}KiB, {pre_series_history_bytes / after:.1f}x)')
+
+def bench_apply_undo(rounds=200, repeat=5):
+    positions = [
+        (game.board, [rule.validate_player_move(game.board, pm) for pm in player_move_list])
+        for game, player_move_list in record_session(rounds)
+    ]
+
+    def copy_apply():
+        for board, player_actions in positions:
+            rule.apply_round(board.copy(), player_actions)
+
+    def apply_undo():
+        for board, player_actions in positions:
+            rule.undo_round(board, rule.apply_round(board, player_actions))
+
+    for name, func in [('copy + apply_round', copy_apply), ('apply_round + undo_round', apply_undo)]:
+        best = min(timed(func) for _ in range(repeat))
+        print(f'{name} per round: {best / len(positions) * 1e6:.0f}us')
+
+own_traces = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+def bench_allocations(rounds=100):
+    session = record_session(rounds)
+    peak_total = retained_total = blocks_total = 0
+    tracemalloc.start()
+    for game, player_move_list in session:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        next_game = game.make_move(player_move_list)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        peak_total += peak - start
+        retained_total += current - start
+        blocks_total += sum(
+            stat.count_diff for stat in
+            after.filter_traces(own_traces).compare_to(before.filter_traces(own_traces), 'filename'))
+        del next_game
+    tracemalloc.stop()
+
+    # garbage collector pressure: refcounting frees a discarded round without any
+    # collection, so count gen-0 collections while the history is kept
+    gc.collect()
+    collections = gc.get_stats()[0]['collections']
+    for _ in range(10):
+        history = replay_chain(session)
+    collections = gc.get_stats()[0]['collections'] - collections
+
+    print(f'Game.make_move per round: peak {peak_total / rounds / 1024:.1f}KiB allocated, '
+        f'{retained_total / rounds / 1024:.1f}KiB in {blocks_total / rounds:.0f} blocks retained, '
+        f'{collections / (10 * rounds):.3f} gen-0 collections')
+
+def unit_memory(boards):
+    seen = set()
+    size = 0
+    for board in boards:
+        for unit in board.board:
+            if unit is None:
+                continue
+            for obj in [unit, unit.__dict__, *unit.__dict__.values()]:
+                if id(obj) not in seen and not isinstance(obj, int):
+                    seen.add(id(obj))
+                    size += sys.getsizeof(obj)
+    return size
+
+def bench_unit_memory(rounds=100):
+    board = Board()
+    set_out(board)
+    history = [game.board for game, _ in record_session(rounds)]
+    print(f'Unit memory: set_out board {unit_memory([board]) / 1024:.1f}KiB, '
+        f'{rounds}-round history {unit_memory(history) / 1024:.1f}KiB')
+
+def candidate_moves(board, player):
+    return [
+        PlayerMove(player, [Move(square_from, square_to)])
+        for square_from in range(board_size) for square_to in range(board_size)
+        if abs(square_from // board_size_y - square_to // board_size_y) <= 2
+            and abs(square_from % board_size_y - square_to % board_size_y) <= 2]
+
+def bench_validate_many(rounds=60, repeat=3):
+    positions = [
+        (game.board, candidate_moves(game.board, player_1)) for game, _ in record_session(rounds)]
+    count = sum(len(player_move_list) for _, player_move_list in positions)
+
+    def one_by_one():
+        for board, player_move_list in positions:
+            for player_move in player_move_list:
+                try:
+                    rule.validate_player_move(board, player_move)
+                except rule.InvalidMoveException:
+                    pass
+
+    def batched():
+        for board, player_move_list in positions:
+            rule.validate_many(board, player_move_list)
+
+    for name, func in [('validate_player_move', one_by_one), ('validate_many', batched)]:
+        best = min(timed(func) for _ in range(repeat))
+        print(f'{name} per candidate move: {best / count * 1e6:.1f}us')
+
+def bench_playout(games=20, max_rounds=300):
+    rng = random.Random(0)
+    rounds = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        rounds += Game().playout(max_rounds, rng).round_count
+    elapsed = time.perf_counter() - start
+    print(f'Random playout: {rounds / elapsed:.0f} rounds/s over {games} games')
+
+def random_force_boards(count, rng):
+    from board import ForceBoard
+    from rule import BoardUnit
+    units = {
+        player: [unit_type(player, SkillSet()) for unit_type in Unit.__subclasses__()]
+        for player in [player_1, player_2]}
+    force_boards = []
+    for _ in range(count):
+        force_board = ForceBoard()
+        for square in rng.sample(range(board_size), 6):
+            for player in rng.sample([player_1, player_2], rng.randint(1, 2)):
+                force_board.arrive(square, player, BoardUnit(rng.choice(units[player]), square))
+                for _ in range(rng.randint(0, 2)):
+                    force_board.reinforce(square, player, BoardUnit(rng.choice(units[player]), square))
+        force_boards.append(force_board)
+    return force_boards
+
+def bench_battle_settlement(count=2000, repeat=5):
+    force_boards = random_force_boards(count, random.Random(0))
+    battles = sum(len(force_board.arrive_board) for force_board in force_boards)
+
+    def settle():
+        for force_board in force_boards:
+            force_board.iterate_battles(force_board.battle)
+
+    best = min(timed(settle) for _ in range(repeat))
+    print(f'Battle settlement: {battles / best / 1e3:.0f}k battles/s')
+
+def bench_incremental_heat(rounds=200, repeat=5):
+    steps = []
+    for game, player_move_list in record_session(rounds):
+        next_board = game.board.copy()
+        record = rule.apply_round(
+            next_board, [rule.validate_player_move(game.board, pm) for pm in player_move_list])
+        steps.append((rule.get_heat_board(game.board), next_board, record.changes))
+
+    def full():
+        for _, next_board, _ in steps:
+            rule.get_heat_board(next_board)
+
+    def incremental():
+        for heat_board, next_board, changes in steps:
+            rule.update_heat_board(heat_board.copy(), next_board, changes)
+
+    for name, func in [('full recompute', full), ('incremental update', incremental)]:
+        best = min(timed(func) for _ in range(repeat))
+        print(f'Heat board per round, {name}: {best / len(steps) * 1e6:.0f}us')
+
+def bench_validation_memo(rounds=60, siblings=4, repeat=3):
+    positions = [
+        (game.board, candidate_moves(game.board, player_1)) for game, _ in record_session(rounds)]
+    count = siblings * sum(len(player_move_list) for _, player_move_list in positions)
+
+    def search(validate_move):
+        for board, player_move_list in positions:
+            for _ in range(siblings):
+                for player_move in player_move_list:
+                    try:
+                        validate_move(board, player_move.move_list[0], player_1)
+                    except rule.InvalidMoveException:
+                        pass
+
+    before = min(timed(lambda: search(rule.validate_move)) for _ in range(repeat))
+    after = None
+    for _ in range(repeat):
+        memo = rule.ValidationMemo()
+        elapsed = timed(lambda: search(memo.validate_move))
+        after = elapsed if after is None else min(after, elapsed)
+    print(f'validate_move per call: direct {before / count * 1e6:.2f}us, '
+        f'memo {after / count * 1e6:.2f}us (hit rate {memo.hit_rate():.1%})')
+
+def bench_vectorized(rounds=200, repeat=5):
+    if not vectorized.available:
+        print('Vectorized heat/buff: numpy not installed, skipped')
+        return
+    boards = [game.board for game, _ in record_session(rounds)]
+
+    cases = [
+        ('heat', lambda: [rule.get_heat_board(board) for board in boards],
+            lambda: vectorized.heat_counts(boards)),
+        ('buff', lambda: [rule.get_buff_board(board) for board in boards],
+            lambda: vectorized.buff_counts(boards))]
+    for name, scalar, batched in cases:
+        before = min(timed(scalar) for _ in range(repeat))
+        after = min(timed(batched) for _ in range(repeat))
+        print(f'{name} per board: bitboard {before / len(boards) * 1e6:.0f}us, '
+            f'numpy batch {after / len(boards) * 1e6:.0f}us ({before / after:.2f}x)')
+
+def bench_batched_rounds(games=1000, repeat=3):
+    if not vectorized.available:
+        print('Batched rounds: numpy not installed, skipped')
+        return
+    rng = random.Random(0)
+    boards = []
+    player_actions_list = []
+    game = Game()
+    while len(boards) < games:
+        if game.get_status() != GameStatus.Ongoing:
+            game = Game()
+        boards.append(game.board)
+        player_actions_list.append([
+            game.random_player_action(player, rng) for player in [player_1, player_2]])
+        game = game.playout(1, rng)
+
+    def per_game():
+        for board, player_actions in zip(boards, player_actions_list):
+            rule.apply_round(board.copy(), player_actions)
+
+    units = vectorized.encode_boards(boards)
+    actions = vectorized.encode_actions(player_actions_list)
+    before = min(timed(per_game) for _ in range(repeat))
+    print(f'apply_round per game: {before / games * 1e6:.0f}us')
+    for batch_size in [64, 256, 1024]:
+        after = min(timed(lambda: vectorized.resolve_rounds(units, actions, batch_size))
+            for _ in range(repeat))
+        print(f'resolve_rounds per game, batch {batch_size}: {after / games * 1e6:.1f}us '
+            f'({before / after:.1f}x)')
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    bench_make_move()
+    bench_history_memory()
+    bench_apply_undo()
+    bench_allocations()
+    bench_unit_memory()
+    bench_validate_many()
+    bench_playout()
+    bench_battle_settlement()
+    bench_incremental_heat()
+    bench_validation_memo()
+    bench_vectorized()
+    bench_batched_rounds()
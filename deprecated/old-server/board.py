@@ -1,64 +1,262 @@
-from const import board_size_x, board_size_y, player_1, player_2
-from copy import deepcopy
-from entity import Position, Wagon, Archer, Rider, King, Soldier, Barbarian, Unit, ActionType
+from const import board_size, board_size_x, board_size_y, player_1, player_2, \
+    skillset_size, skillset_range
+from entity import square_of, Wagon, Archer, Rider, King, Soldier, Barbarian, Unit, ActionType, \
+    duel_table
 import json
+import random
 
 board_setting_1st_row = [Archer, Wagon, Archer, Rider, King, Rider, Archer, Wagon, Archer]
 board_setting_2nd_row = [Barbarian, Soldier, Barbarian, Soldier, Barbarian, Soldier, Barbarian, Soldier, Barbarian]
 
-class Board:
+def shift(mask, offset):
+    return mask << offset if offset >= 0 else mask >> -offset
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+def squares_of(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def build_skill_reach():
+    skill_reach = []
+    for i in range(skillset_size):
+        for j in range(skillset_size):
+            dx, dy = i - skillset_range, j - skillset_range
+            source = 0
+            for x in range(board_size_x):
+                for y in range(board_size_y):
+                    if 0 <= x + dx < board_size_x and 0 <= y + dy < board_size_y:
+                        source |= 1 << square_of(x, y)
+            skill_reach.append((source, dx * board_size_y + dy))
+    return skill_reach
+
+def build_skill_targets():
+    skill_targets = []
+    for square in range(board_size):
+        x, y = divmod(square, board_size_y)
+        targets = []
+        for i in range(skillset_size):
+            for j in range(skillset_size):
+                new_x, new_y = x + i - skillset_range, y + j - skillset_range
+                if 0 <= new_x < board_size_x and 0 <= new_y < board_size_y:
+                    targets.append(square_of(new_x, new_y))
+                else:
+                    targets.append(None)
+        skill_targets.append(targets)
+    return skill_targets
+
+# (squares the skill stays on board from, square offset) per skill index
+skill_reach = build_skill_reach()
+# target square, or None when off board, per square and skill index
+skill_targets = build_skill_targets()
+
+def build_zobrist_keys(seed=0x1a2ce7):
+    rng = random.Random(seed)
+    def keys():
+        return [rng.getrandbits(64) for square in range(board_size)]
+    unit_keys = {
+        (type_, player): keys()
+        for type_ in Unit.__subclasses__()
+        for player in [player_1, player_2]
+    }
+    skill_keys = [
+        [rng.getrandbits(64) for index in range(skillset_size ** 2)]
+        for square in range(board_size)
+    ]
+    return unit_keys, skill_keys
+
+# random keys per (unit type, owner) and per skill index, for every square
+zobrist_unit_keys, zobrist_skill_keys = build_zobrist_keys()
+
+class Grid:
     def __init__(self, constructor=lambda: None):
-        self.board = [[
-            constructor()
-            for j in range(board_size_y)]
-            for i in range(board_size_x)]
+        self.grid = [constructor() for square in range(board_size)]
 
-    def at(self, position):
-        return self.board[position.x][position.y]
-    
-    def put(self, position, unit):
-        self.board[position.x][position.y] = unit
+    def at(self, square):
+        return self.grid[square]
+
+    def put(self, square, item):
+        self.grid[square] = item
+
+class Board:
+    def __init__(self):
+        self.board = [None] * board_size
+        self.occupancy = { player_1: 0, player_2: 0 }
+        self.unit_masks = {}
+        self.skill_planes = { 
+            player_1: [0] * skillset_size ** 2, 
+            player_2: [0] * skillset_size ** 2 
+        }
+        self.king_square = { player_1: None, player_2: None }
+        self.zobrist = 0
+        self.journal = None
+        self.shared = False
 
-    def remove(self, position):
-        unit = self.board[position.x][position.y]
-        self.board[position.x][position.y] = None
+    def at(self, square):
+        return self.board[square]
+
+    def hash(self):
+        return self.zobrist
+    
+    def put(self, square, unit):
+        if self.shared:
+            self.unshare()
+        resident = self.board[square]
+        if self.journal is not None:
+            self.journal.append((square, resident))
+        if resident is not None:
+            self.untrack(square, resident)
+        self.board[square] = unit
+        if unit is not None:
+            self.track(square, unit)
+
+    def remove(self, square):
+        if self.shared:
+            self.unshare()
+        unit = self.board[square]
+        if unit is not None:
+            if self.journal is not None:
+                self.journal.append((square, unit))
+            self.untrack(square, unit)
+            self.board[square] = None
         return unit
 
+    def track(self, square, unit):
+        bit = 1 << square
+        self.occupancy[unit.owner] |= bit
+        key = (type(unit), unit.owner)
+        self.unit_masks[key] = self.unit_masks.get(key, 0) | bit
+        if key[0] is King:
+            self.king_square[unit.owner] = square
+        zobrist = zobrist_unit_keys[key][square]
+        skill_keys = zobrist_skill_keys[square]
+        planes = self.skill_planes[unit.owner]
+        for index in unit.skillset.skill_indices():
+            planes[index] |= bit
+            zobrist ^= skill_keys[index]
+        self.zobrist ^= zobrist
+
+    def untrack(self, square, unit):
+        bit = ~(1 << square)
+        key = (type(unit), unit.owner)
+        self.occupancy[unit.owner] &= bit
+        self.unit_masks[key] &= bit
+        if key[0] is King and self.king_square[unit.owner] == square:
+            kings = self.unit_masks[key]
+            self.king_square[unit.owner] = kings.bit_length() - 1 if kings else None
+        zobrist = zobrist_unit_keys[key][square]
+        skill_keys = zobrist_skill_keys[square]
+        planes = self.skill_planes[unit.owner]
+        for index in unit.skillset.skill_indices():
+            planes[index] &= bit
+            zobrist ^= skill_keys[index]
+        self.zobrist ^= zobrist
+
+    def unshare(self):
+        self.board = self.board.copy()
+        self.occupancy = self.occupancy.copy()
+        self.unit_masks = self.unit_masks.copy()
+        self.king_square = self.king_square.copy()
+        self.skill_planes = {
+            player: planes.copy() for player, planes in self.skill_planes.items()
+        }
+        self.shared = False
+
+    def unit_mask(self, owner, type_=None):
+        if type_ is None:
+            return self.occupancy[owner]
+        return self.unit_masks.get((type_, owner), 0)
+
+    def reach(self, square):
+        mask = 0
+        targets = skill_targets[square]
+        for index in self.board[square].skillset.skill_indices():
+            if targets[index] is not None:
+                mask |= 1 << targets[index]
+        return mask
+
+    def reach_planes(self, player):
+        planes = []
+        for index, plane in enumerate(self.skill_planes[player]):
+            if plane:
+                source, offset = skill_reach[index]
+                planes.append(shift(plane & source, offset))
+        return planes
+
+    def attack_mask(self, player):
+        mask = 0
+        for plane in self.reach_planes(player):
+            mask |= plane
+        return mask
+
     def move(self, move):
-        unit = self.at(move.position_from)
-        self.put(move.position_to, unit)
-        self.remove(move.position_from)
+        unit = self.at(move.square_from)
+        self.put(move.square_to, unit)
+        self.remove(move.square_from)
 
-    def iterate_units(self, func):
-        for i in range(board_size_x):
-            for j in range(board_size_y):
-                u = self.board[i][j]
-                if u is not None:
-                    func(u, Position(i, j))
+    def iterate_units(self, func, player=None):
+        if player is None:
+            mask = self.occupancy[player_1] | self.occupancy[player_2]
+        else:
+            mask = self.occupancy[player]
+        for square in squares_of(mask):
+            func(self.board[square], square)
     
     def copy(self):
-        return deepcopy(self)
+        board = Board.__new__(Board)
+        board.journal = None
+        board.restore(self.snapshot())
+        return board
+
+    def snapshot(self):
+        # the cell array and masks are shared until the board is written to
+        self.shared = True
+        return (self.board, self.occupancy, self.unit_masks, self.skill_planes,
+            self.king_square, self.zobrist)
+
+    def restore(self, snapshot):
+        (self.board, self.occupancy, self.unit_masks, self.skill_planes,
+            self.king_square, self.zobrist) = snapshot
+        self.shared = True
+
+    # private copies of the masks and hash, taken before a round so it can be rewound
+    def mask_state(self):
+        return (self.occupancy.copy(), self.unit_masks.copy(),
+            { player: planes.copy() for player, planes in self.skill_planes.items() },
+            self.king_square.copy(), self.zobrist)
+
+    # writes cells back and reinstates the masks of a mask_state taken before they changed
+    def rewind(self, cells, mask_state):
+        if self.shared:
+            self.board = self.board.copy()
+            self.shared = False
+        for square, unit in cells.items():
+            if self.journal is not None:
+                self.journal.append((square, self.board[square]))
+            self.board[square] = unit
+        (self.occupancy, self.unit_masks, self.skill_planes,
+            self.king_square, self.zobrist) = mask_state
 
     def serialize(self):
         s = []
-        for i in range(board_size_x):
-            for j in range(board_size_y):
-                unit = self.at(Position(i, j))
-                if unit:
-                    s.append(unit.serialize())
-                else:
-                    s.append(0)
+        for unit in self.board:
+            if unit:
+                s.append(unit.serialize())
+            else:
+                s.append(0)
         return json.dumps(s)
 
     @classmethod
     def deserialize(cls, payload):
         b = Board()
         s = json.loads(payload)
-        for i in range(board_size_x):
-            for j in range(board_size_y):
-                u = s.pop(0)
-                if u != 0:
-                    b.put(Position(i, j), Unit.deserialize(u))
+        for square in range(board_size):
+            u = s[square]
+            if u != 0:
+                b.put(square, Unit.deserialize(u))
         return b
 
 def set_out(board):
@@ -69,9 +267,11 @@ def set_out(board):
         (board_size_y - 2, board_setting_2nd_row, player_1)
     ]:
         for i in range(board_size_x):
-            board.put(Position(i, row), setting[i](player))
+            board.put(square_of(i, row), setting[i](player))
 
 class ArriverMap:
+    __slots__ = ('map',)
+
     def __init__(self):
         self.map = { player_1: None, player_2: None }
 
@@ -88,6 +288,8 @@ class ArriverMap:
         self.map[player] = unit
 
 class ReinforcerMap:
+    __slots__ = ('map',)
+
     def __init__(self):
         self.map = { player_1: [], player_2: [] }
     
@@ -95,6 +297,8 @@ class ReinforcerMap:
         return self.map[player]
 
 class HeatMap:
+    __slots__ = ('map',)
+
     def __init__(self):
         self.map = { player_1: 0, player_2: 0 }
 
@@ -102,6 +306,8 @@ class HeatMap:
         return self.map[player]        
 
 class BuffMap:
+    __slots__ = ('map',)
+
     def __init__(self):
         self.map = {
             ActionType.Attack: 0,
@@ -117,6 +323,8 @@ class BuffMap:
         return self.map[type_]
 
 class BattleOutcome:
+    __slots__ = ('arriver_map', 'reinforcers_map', 'player_won')
+
     def __init__(self, player_won, arriver_map, reinforcers_map):
         self.arriver_map = arriver_map
         self.reinforcers_map = reinforcers_map
@@ -133,73 +341,88 @@ class BattleOutcome:
     def is_skirmish(self):
         return self.arriver_map.count() > 1
 
+# winner of a battle by reinforcer counts, falling back on the duel outcome of the arrivers
+# (1 if player_1 prevails, -1 if player_2 does, 0 for a tie)
+duel_winners = { 1: player_1, -1: player_2, 0: None }
+
+def battle_winner(r1, r2, duel):
+    if r1 > r2:
+        return player_1
+    elif r2 > r1:
+        return player_2
+    return duel_winners[duel]
+
+# forces are only tracked on the squares some action arrives at or reinforces
 class ForceBoard:
     def __init__(self):
-        self.reinforce_board = Board(ReinforcerMap)
-        self.arrive_board = Board(ArriverMap)
-
-    def reinforcer_count(self, position, player):
-        return len(self.reinforce_board.at(position).get(player))
-
-    def battle(self, position):
-        winner = None
-        r1 = self.reinforcer_count(position, player_1)
-        r2 = self.reinforcer_count(position, player_2)
-        if r1 > r2:
-            winner = player_1
-        elif r2 > r1:
-            winner = player_2
+        self.reinforce_board = {}
+        self.arrive_board = {}
+
+    def battle(self, square):
+        amap = self.arrive_board[square]
+        reinforcers = self.reinforce_board.get(square) or ReinforcerMap()
+        bu1 = amap.get(player_1)
+        bu2 = amap.get(player_2)
+        if bu2 is None:
+            duel = 1
+        elif bu1 is None:
+            duel = -1
         else:
-            amap = self.arrive_board.at(position)
-            if amap.count() == 1:
-                winner = amap.arrived_players()[0]
-            else:
-                bu1 = amap.get(player_1)
-                bu2 = amap.get(player_2)
-                surviver = bu1.unit.duel(bu2.unit)
-                if surviver:
-                    winner = surviver.owner
-                else:
-                    winner = None
-
-        return BattleOutcome(
-            winner, 
-            self.arrive_board.at(position), 
-            self.reinforce_board.at(position))
-
-    def reinforce(self, position, player, unit):
-        self.reinforce_board.at(position).get(player).append(unit)
-
-    def reinforcers(self, position, player):
-        return self.reinforce_board.at(position).get(player)
-
-    def arrive(self, position, player, unit):
-        amap = self.arrive_board.at(position)
+            duel = duel_table[type(bu1.unit), type(bu2.unit)]
+        winner = battle_winner(
+            len(reinforcers.get(player_1)), len(reinforcers.get(player_2)), duel)
+        return BattleOutcome(winner, amap, reinforcers)
+
+    def reinforce(self, square, player, unit):
+        reinforcers = self.reinforce_board.get(square)
+        if reinforcers is None:
+            reinforcers = self.reinforce_board[square] = ReinforcerMap()
+        reinforcers.get(player).append(unit)
+
+    def reinforcers(self, square, player):
+        reinforcers = self.reinforce_board.get(square)
+        if reinforcers is None:
+            return []
+        return reinforcers.get(player)
+
+    def arrive(self, square, player, unit):
+        amap = self.arrive_board.get(square)
+        if amap is None:
+            amap = self.arrive_board[square] = ArriverMap()
         assert(amap.get(player) is None)
         amap.arrive(player, unit)
 
-    def arriver(self, position, player):
-        return self.arrive_board.at(position).get(player)
+    def arriver(self, square, player):
+        amap = self.arrive_board.get(square)
+        if amap is None:
+            return None
+        return amap.get(player)
 
     def iterate_battles(self, func):
-        for i in range(board_size_x):
-            for j in range(board_size_y):
-                p = Position(i, j)
-                if self.arrive_board.at(p).count() > 0:
-                    func(p)
+        for square in sorted(self.arrive_board):
+            func(square)
 
 class HeatBoard:
     def __init__(self):
-        self.board = Board(HeatMap)
+        self.heat_map = { player_1: [0] * board_size, player_2: [0] * board_size }
 
-    def heat(self, position, player):
-        return self.board.at(position).get(player)
+    def heat(self, square, player):
+        return self.heat_map[player][square]
 
-    def heatup(self, position, player):
-        self.board.at(position).map[player] += 1
+    def heatup(self, square, player):
+        self.heat_map[player][square] += 1
+
+    def copy(self):
+        heat_board = HeatBoard.__new__(HeatBoard)
+        heat_board.heat_map = { player: heat.copy() for player, heat in self.heat_map.items() }
+        return heat_board
+
+    def __eq__(self, other):
+        return self.heat_map == other.heat_map
 
     def iterate(self, func):
-        for i in range(board_size_x):
-            for j in range(board_size_y):
-                p = Position(i, j)
-                func(self.board.at(p), p)
+        for square in range(board_size):
+            heat_map = HeatMap()
+            for player in heat_map.map:
+                heat_map.map[player] = self.heat_map[player][square]
+            func(heat_map, square)
@@ -1,5 +1,6 @@
 board_size_x = 9
 board_size_y = 9
+board_size = board_size_x * board_size_y
 
 player_1 = 1
 player_2 = 2
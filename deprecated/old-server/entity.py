@@ -1,9 +1,14 @@
 import skills
 from enum import Enum
-from const import board_size_x, board_size_y, skillset_size, skillset_range, player_1
+from const import board_size_x, board_size_y, skillset_size, skillset_range, player_1, player_2
 import json
 
+def square_of(x, y):
+    return x * board_size_y + y
+
 class Move:
+    __slots__ = ('square_from', 'square_to')
+
     @classmethod
     def from_literal(self, literal):
         try:
@@ -15,24 +20,34 @@ class Move:
         except:
             raise InvalidParameter("move literal")
         else:
-            return Move(position_1, position_2)
+            return Move(position_1.square, position_2.square)
+
+    def __init__(self, square_from, square_to):
+        self.square_from = square_from
+        self.square_to = square_to
 
-    def __init__(self, position_from, position_to):
-        self.position_from = position_from
-        self.position_to = position_to
+    @property
+    def position_from(self):
+        return Position.from_square(self.square_from)
+
+    @property
+    def position_to(self):
+        return Position.from_square(self.square_to)
     
     def __eq__(self, move):
-        return self.position_from == move.position_from and \
-            self.position_to == move.position_to
+        return self.square_from == move.square_from and \
+            self.square_to == move.square_to
 
     def is_from_same(self, move):
-        return self.position_from == move.position_from
+        return self.square_from == move.square_from
 
     def is_to_same(self, move):
-        return self.position_to == move.position_to
+        return self.square_to == move.square_to
 
     def get_skill(self):
-        return Skill(self.position_from.get_delta(self.position_to))
+        x1, y1 = divmod(self.square_from, board_size_y)
+        x2, y2 = divmod(self.square_to, board_size_y)
+        return Skill(PositionDelta(x2 - x1, y2 - y1))
 
     def __repr__(self):
         return str(self.position_from) + '->' + str(self.position_to)
@@ -41,6 +56,8 @@ class Move:
         return self.position_from.serialize() + self.position_to.serialize()
 
 class PlayerMove:
+    __slots__ = ('player', 'move_list')
+
     @classmethod
     def from_literal(self, player, literal):
         try:
@@ -56,6 +73,8 @@ class PlayerMove:
         return ','.join([str(m) for m in self.move_list])
 
 class Action:
+    __slots__ = ('move', 'type', 'unit_type')
+
     def __init__(self, move, type_, unit_type):
         self.move = move
         self.type = type_
@@ -65,15 +84,7 @@ class Action:
         return f'{self.move}({ActionType.show(self.type)})'
 
     def get_cost(self, buff_board):
-        cost = self.standard_cost()
-        buff = buff_board.at(self.move.position_from)
-        try:
-            cost += buff.get(self.type)
-        except KeyError:
-            pass
-        if cost < 1:
-            return 1
-        return cost
+        return buffed_cost(self.standard_cost(), buff_board.at(self.move.square_from), self.type)
 
     def standard_cost(self):
         if self.type == ActionType.Defend:
@@ -108,16 +119,25 @@ class Action:
     def serialize(self):
         return json.dumps([self.type.value, self.unit_type.__name__, self.move.serialize()])
 
+def buffed_cost(cost, buff, type_):
+    if type_ in buff.map:
+        cost += buff.get(type_)
+    if cost < 1:
+        return 1
+    return cost
+
 class PlayerAction:
+    __slots__ = ('player', 'action_list')
+
     def __init__(self, player, action_list):
         self.player = player
         self.action_list = action_list
     
-    def extract_actions(self, filter):
-        extracted = [a for a in self.action_list if filter(a)]
-        remaining = [a for a in self.action_list if not filter(a)]
-        self.action_list = remaining
-        return extracted
+    def bucket_actions(self):
+        buckets = {type_: [] for type_ in ActionType}
+        for action in self.action_list:
+            buckets[action.type].append(action)
+        return buckets
 
     def copy(self):
         return PlayerAction(self.player, self.action_list.copy())
@@ -140,6 +160,9 @@ class ActionType(Enum):
     Recruit = 5
     Recall = 6
 
+    # members compare by identity, so hash them by identity in C instead of Enum's hash of the name
+    __hash__ = object.__hash__
+
     @classmethod
     def show(self, action_type):
         return {
@@ -152,12 +175,23 @@ class ActionType(Enum):
         }[action_type]
 
 class Position:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         if not (0 <= x < board_size_x and 0 <= y < board_size_y):
             raise InvalidParameter("Position")
         self.x = x
         self.y = y
 
+    @property
+    def square(self):
+        return square_of(self.x, self.y)
+
+    @classmethod
+    def from_square(self, square):
+        x, y = divmod(square, board_size_y)
+        return Position(x, y)
+
     @classmethod
     def from_literal(self, literal):
         try:
@@ -175,10 +209,11 @@ class Position:
         return self.x == position.x and self.y == position.y
 
     def get_new_position(self, position_delta):
-        try:
-            return Position(self.x + position_delta.dx, self.y + position_delta.dy)
-        except InvalidParameter:
-            return None
+        x = self.x + position_delta.dx
+        y = self.y + position_delta.dy
+        if 0 <= x < board_size_x and 0 <= y < board_size_y:
+            return Position(x, y)
+        return None
 
     def __str__(self):
         return f'{self.x + 1}{self.y + 1}'
@@ -195,23 +230,45 @@ class Unit:
     trophy = 0
     basic = False
     advanced = False
+
+    # units are immutable and interned by (type, owner, skillset mask)
+    interned = {}
     
-    def __init__(self, owner, skillset=None):
-        self.owner = owner
-        self.perfect_skillset = potential_skillset_map[self.display].copy()
+    def __new__(cls, owner, skillset=None):
         if skillset is None:
-            self.skillset = inborn_skillset_map[self.display].copy()
-        else:
-            self.skillset = skillset.copy()
+            return cls.intern(owner, cls.inborn_skillset[owner])
 
+        skillset = skillset.copy()
         if owner == player_1:
-            self.skillset.flip()
+            skillset.flip()
+        return cls.intern(owner, skillset)
+
+    @classmethod
+    def intern(cls, owner, skillset):
+        key = (cls, owner, skillset.mask)
+        unit = Unit.interned.get(key)
+        if unit is None:
+            unit = object.__new__(cls)
+            unit.owner = owner
+            unit.skillset = skillset
+            # computed once per unit state; the results must not be mutated
+            unit.ultimate = unit.build_ultimate_skillset()
+            unit.potential = unit.ultimate.copy().subtract(skillset)
+            Unit.interned[key] = unit
+        return unit
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def endow(self, skill):
-        if self.perfect_skillset.has(skill):
-            self.skillset.add(skill)
-            return True
-        return False
+        if not self.perfect_skillset.has(skill):
+            return None
+        skillset = self.skillset.copy()
+        skillset.add(skill)
+        return type(self).intern(self.owner, skillset)
         
     def has_skill(self, skill):
         return self.skillset.has(skill)
@@ -226,13 +283,17 @@ class Unit:
         return self.basic and self.is_perfect()
 
     def potential_skillset(self):
-        return self.ultimate_skillset().subtract(self.skillset)
+        return self.potential
     
     def ultimate_skillset(self):
+        return self.ultimate
+
+    def build_ultimate_skillset(self):
+        if not self.is_promotion_ready():
+            return self.perfect_skillset
         ultimate = self.perfect_skillset.copy()
-        if self.is_promotion_ready():
-            for creator in promotion_map[type(self)]:
-                ultimate.union(potential_skillset_map[creator.display])
+        for creator in promotion_map[type(self)]:
+            ultimate.union(creator.perfect_skillset)
         return ultimate
 
     def get_promoted(self, skill):
@@ -243,16 +304,15 @@ class Unit:
         if creator is None:
             return None
         promoted = creator(self.owner, skillset=self.skillset)
-        promoted.endow(skill)
-        return promoted
+        return promoted.endow(skill)
     
     def duel(self, other):
-        if self.level == other.level:
-            return None
-        elif self.level > other.level:
+        outcome = duel_table[type(self), type(other)]
+        if outcome > 0:
             return self
-        else:
+        elif outcome < 0:
             return other
+        return None
     
     def get_trophy(self):
         return self.trophy
@@ -282,9 +342,12 @@ class Unit:
     @classmethod
     def deserialize(cls, payload):
         [typename, owner, p_skillset] = json.loads(payload)
-        return eval(typename)(owner, SkillSet.deserialize(p_skillset))
+        # the stored skillset is already oriented for its owner
+        return eval(typename).intern(owner, SkillSet.deserialize(p_skillset))
 
 class PositionDelta:
+    __slots__ = ('dx', 'dy')
+
     def __init__(self, dx, dy):
         self.dx = dx
         self.dy = dy
@@ -296,6 +359,8 @@ class InvalidParameter(Exception):
     pass
 
 class Skill:
+    __slots__ = ('delta',)
+
     def __init__(self, position_delta):
         self.delta = position_delta
         if not (
@@ -306,73 +371,90 @@ class Skill:
     def is_leap(self):
         return abs(self.delta.dx) > 1 or abs(self.delta.dy) > 1
 
+    def index(self):
+        return (self.delta.dx + skillset_range) * skillset_size + self.delta.dy + skillset_range
+
 class SkillSet:
-    op_union = lambda a, b: a or b
-    op_common = lambda a, b: a and b
-    op_subtract = lambda a, b: a and not b
+    __slots__ = ('mask',)
 
     def __init__(self, skill_list=[]):
-        self.map = [[False] * skillset_size for i in range(skillset_size)]
+        self.mask = 0
         for skill in skill_list:
             self.add(skill)
 
-    def apply(self, operator, skillset):
-        self.map = [
-            [
-                operator(self.map[i][j], skillset.map[i][j]) 
-                for j in range(skillset_size)
-            ]
-            for i in range(skillset_size)
-        ]
-        return self
+    @classmethod
+    def from_mask(cls, mask):
+        skillset = SkillSet.__new__(SkillSet)
+        skillset.mask = mask
+        return skillset
 
     def copy(self):
-        return SkillSet().union(self)
+        return SkillSet.from_mask(self.mask)
 
     def union(self, skillset):
-        return self.apply(SkillSet.op_union, skillset)
+        self.mask |= skillset.mask
+        return self
 
     def subtract(self, skillset):
-        return self.apply(SkillSet.op_subtract, skillset)
+        self.mask &= ~skillset.mask
+        return self
 
     def __eq__(self, other):
-        return all(
-            self.map[i][j] == other.map[i][j]
-            for i in range(skillset_size)
-            for j in range(skillset_size))
+        return self.mask == other.mask
 
     def flip(self):
-        self.map = [list(reversed(col)) for col in self.map]
+        mask = 0
+        for x in range(skillset_size):
+            shift = x * skillset_size
+            mask |= flipped_rows[self.mask >> shift & row_mask] << shift
+        self.mask = mask
 
     def add(self, skill):
-        self.map[skill.delta.dx + skillset_range][skill.delta.dy + skillset_range] = True
+        self.mask |= 1 << skill.index()
 
     def has(self, skill):
-        return self.map[skill.delta.dx + skillset_range][skill.delta.dy + skillset_range]
+        return self.mask >> skill.index() & 1 == 1
+
+    def skill_indices(self):
+        indices = skill_indices_table.get(self.mask)
+        if indices is None:
+            indices = tuple(
+                index for index in range(skillset_size ** 2)
+                if self.mask >> index & 1)
+            skill_indices_table[self.mask] = indices
+        return indices
 
     def list_skills(self):
-        return [
-            Skill(PositionDelta(x - skillset_range, y - skillset_range))
-            for x in range(skillset_size)
-            for y in range(skillset_size)
-            if self.map[x][y]
-        ]
+        skills = skill_list_table.get(self.mask)
+        if skills is None:
+            skills = tuple(
+                Skill(PositionDelta(
+                    index // skillset_size - skillset_range, 
+                    index % skillset_size - skillset_range))
+                for index in self.skill_indices())
+            skill_list_table[self.mask] = skills
+        return skills
     
     def serialize(self):
-        m = []
-        for i in range(skillset_size):
-            for j in range(skillset_size):
-                m.append(1 if self.map[i][j] else 0)
-        return json.dumps(m)
+        return json.dumps([self.mask >> index & 1 for index in range(skillset_size ** 2)])
 
     @classmethod
     def deserialize(cls, payload):
-        s = SkillSet()
-        m = json.loads(payload)
-        for i in range(skillset_size):
-            for j in range(skillset_size):
-                s.map[i][j] = m[i][j] == 1
-        return s
+        mask = 0
+        for index, bit in enumerate(json.loads(payload)):
+            if bit == 1:
+                mask |= 1 << index
+        return SkillSet.from_mask(mask)
+
+row_mask = (1 << skillset_size) - 1
+# each 5-bit row of a skillset mask with its skills mirrored along y
+flipped_rows = [
+    sum(1 << (skillset_size - 1 - y) for y in range(skillset_size) if row >> y & 1)
+    for row in range(1 << skillset_size)
+]
+# skill indices and Skill tuples per skillset mask, filled on first use
+skill_indices_table = {}
+skill_list_table = {}
 
 class Rider(Unit):
     display = "RDR"
@@ -457,3 +539,23 @@ promotion_map = {
 potential_skillset_map = convert_skill_list_map_to_skillset_map(skills.potential_skill_list_map)
 inborn_skillset_map = convert_skill_list_map_to_skillset_map(skills.inborn_skill_list_map)
 
+def flipped(skillset):
+    skillset = skillset.copy()
+    skillset.flip()
+    return skillset
+
+# shared by every unit of a class, never copied per instance
+for unit_type in Unit.__subclasses__():
+    unit_type.perfect_skillset = potential_skillset_map[unit_type.display]
+    if unit_type.display in inborn_skillset_map:
+        inborn = inborn_skillset_map[unit_type.display]
+        unit_type.inborn_skillset = {
+            player_1: flipped(inborn),
+            player_2: inborn
+        }
+
+# duel outcome by (unit class, unit class): 1 if the first survives, -1 if the second does, 0 if both fall
+duel_table = {
+    (first, second): (first.level > second.level) - (first.level < second.level)
+    for first in Unit.__subclasses__() for second in Unit.__subclasses__()
+}
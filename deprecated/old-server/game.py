@@ -1,8 +1,9 @@
-from entity import Position, Move, PlayerMove, Wagon
-from board import Board, set_out
+from entity import Position, Move, PlayerMove, PlayerAction, Wagon
+from board import Board, set_out, squares_of
 from const import player_1, player_2, board_size_x
 import rule
 import random
+import itertools
 from enum import Enum
 from copy import copy
 import json
@@ -13,10 +14,35 @@ class GameStatus(Enum):
     Defeated = 2
     Draw = 3
 
+# cheapest action still available from group i onwards
+def suffix_min_cost(groups):
+    min_cost = [None] * len(groups) + [float('inf')]
+    for i in reversed(range(len(groups))):
+        min_cost[i] = min(min_cost[i + 1], min(cost for cost, _ in groups[i]))
+    return min_cost
+
+# one affordable PlayerMove drawn from the root: the groups are reshuffled for
+# every draw, then each group keeps or skips a uniformly picked affordable option
+def random_descent(player, groups, budget, rng):
+    groups = list(groups)
+    rng.shuffle(groups)
+    min_cost = suffix_min_cost(groups)
+    move_list = []
+    for i, options in enumerate(groups):
+        if min_cost[i] > budget:
+            break
+        options = [None] + [option for option in options if option[0] <= budget]
+        option = rng.choice(options)
+        if option is not None:
+            budget -= option[0]
+            move_list.append(option[1])
+    return PlayerMove(player, move_list)
+
 class Game:
     supply_initial = 20
     supply_basic_incremental = 20
     msg_not_enough_supply = "not enough supply"
+    playout_action_rate = 0.25
 
     def __init__(self, board=None):
         if board is None:
@@ -37,6 +63,14 @@ class Game:
 
         self.round_count = 0
         self.martyr_list = []
+        self.cache = {}
+
+    def hash(self):
+        return hash((
+            self.board.hash(),
+            self.supply[player_1],
+            self.supply[player_2],
+            self.round_count))
 
     def get_status(self):
         return {
@@ -50,15 +84,28 @@ class Game:
         for player_move in player_move_list:
             self.validate_player_move(player_move)
 
+        # carry the heat board over when it has been asked for on this board
+        heat_board = self.cached_value('heat_board')
+        if heat_board is not None:
+            heat_board = heat_board.copy()
+
         next_board, player_action_map, martyr_list = \
-            rule.make_move(self.board, player_move_list)
+            rule.make_move(self.board, player_move_list, heat_board, self.get_validation_context())
+
+        next_game = self.next_game(next_board, player_action_map, martyr_list)
+        if heat_board is not None:
+            next_game.cache['heat_board'] = (next_board, next_board.hash(), heat_board)
+        # advanced positions stay in the game history, so they must not hold derived boards
+        self.cache.clear()
+        return next_game
 
+    def next_game(self, next_board, player_action_map, martyr_list):
         next_game = Game(next_board)
         next_game.last_player_action = player_action_map
         next_game.round_count = self.round_count + 1
         next_game.martyr_list = martyr_list
 
-        buff_board = rule.get_buff_board(self.board)
+        buff_board = self.get_buff_board()
 
         for player_action in player_action_map.values():
             player = player_action.player
@@ -70,23 +117,115 @@ class Game:
         return next_game
 
     def validate_player_move(self, player_move):
-        player_action = rule.validate_player_move(self.board, player_move)
-        buff_board = rule.get_buff_board(self.board)
-        if player_action.get_cost(buff_board) > self.supply[player_action.player]:
+        player_action = rule.validate_player_move(
+            self.board, player_move, self.get_validation_context())
+        if player_action.get_cost(self.get_buff_board()) > self.supply[player_action.player]:
             raise rule.InvalidMoveException(Game.msg_not_enough_supply)
         return player_action
 
+    # derived boards are kept until self.board is replaced or mutated
+    def cached(self, name, build):
+        value = self.cached_value(name)
+        if value is None:
+            value = build(self.board)
+            self.cache[name] = (self.board, self.board.hash(), value)
+        return value
+
+    def cached_value(self, name):
+        board, state, value = self.cache.get(name, (None, None, None))
+        if board is not self.board or state != self.board.hash():
+            return None
+        return value
+
+    def get_heat_board(self):
+        return self.cached('heat_board', rule.get_heat_board)
+
+    def get_validation_context(self):
+        return self.cached('validation_context', rule.ValidationContext)
+
+    def get_buff_board(self):
+        return self.get_validation_context().buff_board()
+
+    # lazily yields the PlayerMoves of player that validate and fit its supply,
+    # one action per unit square; with an rng, independent random draws (possibly
+    # repeating, endless unless limit is given) instead of the exhaustive walk
+    def affordable_player_moves(self, player, limit=None, rng=None):
+        groups = {}
+        for action, cost in rule.legal_actions(self.board, player, self.get_validation_context()):
+            groups.setdefault(action.move.square_from, []).append((cost, action.move))
+        groups = list(groups.values())
+        budget = self.supply[player]
+        if rng is not None:
+            for _ in itertools.count() if limit is None else range(limit):
+                yield random_descent(player, groups, budget, rng)
+            return
+
+        for options in groups:
+            options.sort(key=lambda option: option[0])
+        min_cost = suffix_min_cost(groups)
+        move_list = []
+        def walk(i, budget):
+            if min_cost[i] > budget:
+                yield PlayerMove(player, list(move_list))
+                return
+            yield from walk(i + 1, budget)
+            for cost, move in groups[i]:
+                if cost > budget:
+                    break
+                move_list.append(move)
+                yield from walk(i + 1, budget - cost)
+                move_list.pop()
+
+        for count, player_move in enumerate(walk(0, budget)):
+            if limit is not None and count >= limit:
+                return
+            yield player_move
+
+    # rollout mode: a random affordable PlayerAction where each square acts with
+    # probability playout_action_rate; actions are only generated for acting squares
+    def random_player_action(self, player, rng=random):
+        actions = rule.LegalActions(self.board, player, self.get_validation_context())
+        squares = [square for square in actions.squares() if rng.random() < Game.playout_action_rate]
+        rng.shuffle(squares)
+
+        budget = self.supply[player]
+        action_list = []
+        for square in squares:
+            candidates = actions.candidates(square)
+            if not candidates:
+                continue
+            action, cost = actions.price(rng.choice(candidates))
+            if cost <= budget:
+                action_list.append(action)
+                budget -= cost
+        return PlayerAction(player, action_list)
+
+    def random_player_move(self, player, rng=random):
+        player_action = self.random_player_action(player, rng)
+        return PlayerMove(player, [action.move for action in player_action.action_list])
+
+    # plays random rounds without revalidating the sampled actions
+    def playout(self, max_rounds, rng=random):
+        game = self
+        for _ in range(max_rounds):
+            if game.get_status() != GameStatus.Ongoing:
+                break
+            player_action_map = {
+                player: game.random_player_action(player, rng) for player in [player_1, player_2]
+            }
+            next_board = game.board.copy()
+            record = rule.apply_round(next_board, player_action_map.values())
+            game = game.next_game(next_board, player_action_map, record.martyr_list)
+        return game
+
     def replenish(self, amount):
         for player in self.supply:
             self.supply[player] += amount
 
     def wagon_supply(self, player):
         revenue = 0
-        def collect_revenue(u, _):
-            nonlocal revenue
-            if u.owner == player and type(u) == Wagon:
-                revenue += 2 if u.is_perfect() else 1
-        self.board.iterate_units(collect_revenue)
+        for square in squares_of(self.board.unit_mask(player, Wagon)):
+            revenue += 2 if self.board.at(square).is_perfect() else 1
         return revenue
     
     def trophy_supply(self, player, martyr_list):
@@ -110,7 +249,7 @@ class Game:
             [player_action.serialize() for player_action in self.last_player_action.values() if player_action is not None],
             [
                 [
-                    martyr.board_unit.position.serialize(), 
+                    Position.from_square(martyr.board_unit.square).serialize(), 
                     martyr.board_unit.unit.get_trophy() if martyr.has_trophy else 0
                 ] for martyr in self.martyr_list
             ]
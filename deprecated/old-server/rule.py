@@ -1,7 +1,9 @@
-from entity import Action, ActionType, InvalidParameter, \
-    King, Move, PlayerAction, PlayerMove, Position, Unit, Lancer, Knight, Warrior, Swordsman, Spearman
-from board import Board, ForceBoard, HeatBoard, BuffMap
-from const import player_1, player_2, board_size_y
+from entity import Action, ActionType, InvalidParameter, buffed_cost, duel_table, \
+    Move, PlayerAction, PlayerMove, Unit, Lancer, Knight, Warrior, Swordsman, Spearman, \
+    Skill, PositionDelta
+from board import Grid, ForceBoard, HeatBoard, BuffMap, popcount, squares_of, skill_targets
+from const import player_1, player_2, board_size, board_size_y, skillset_size, skillset_range
+from collections import OrderedDict
 
 max_unit_count = 28
 
@@ -9,128 +11,231 @@ class InvalidMoveException(Exception):
     pass
 
 class BoardUnit:
-    def __init__(self, unit, position):
+    __slots__ = ('unit', 'square')
+
+    def __init__(self, unit, square):
         self.unit = unit
-        self.position = position
+        self.square = square
 
 class Martyr:
+    __slots__ = ('board_unit', 'has_trophy')
+
     def __init__(self, board_unit, has_trophy = True):
         self.board_unit = board_unit
         self.has_trophy = has_trophy
 
-def make_move(board, player_move_list):
+class RoundRecord:
+    __slots__ = ('changes', 'martyr_list', 'mask_state')
+
+    def __init__(self, mask_state=None):
+        self.changes = []
+        self.martyr_list = []
+        self.mask_state = mask_state
+
+class ValidationContext:
+    __slots__ = ('board', 'king_side', 'unit_count', 'attack', 'buff')
+
+    def __init__(self, board):
+        self.board = board
+        self.king_side = {}
+        self.unit_count = {}
+        for player in [player_1, player_2]:
+            king_square = board.king_square[player]
+            self.king_side[player] = 0 if king_square is None else board.reach(king_square)
+            self.unit_count[player] = popcount(board.unit_mask(player))
+        self.attack = {}
+        self.buff = None
+
+    def attack_mask(self, player):
+        if player not in self.attack:
+            self.attack[player] = self.board.attack_mask(player)
+        return self.attack[player]
+
+    def buff_board(self):
+        if self.buff is None:
+            self.buff = get_buff_board(self.board)
+        return self.buff
+
+# bounded LRU of validate_move outcomes keyed by (board hash, move squares, player)
+class ValidationMemo:
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def validate_move(self, board, move, player):
+        key = (board.hash(), move.square_from, move.square_to, player)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            try:
+                action = validate_move(board, move, player)
+                entry = (action.type, action.unit_type)
+            except InvalidMoveException as e:
+                entry = str(e)
+            self.entries[key] = entry
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        if type(entry) is str:
+            raise InvalidMoveException(entry)
+        return Action(move, *entry)
+
+    def validate_player_move(self, board, player_move):
+        moves = player_move.move_list
+        check_single_moves(moves)
+        return PlayerAction(
+            player_move.player,
+            [self.validate_move(board, move, player_move.player) for move in moves])
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+# heat_board, if given, is the heat of board and gets updated to the heat of next_board
+def make_move(board, player_move_list, heat_board=None, context=None):
+    if context is None:
+        context = ValidationContext(board)
     player_action_map = {}
     for player_move in player_move_list:
-        player_action_map[player_move.player] = validate_player_move(board, player_move)
-
-    player_action_list = [player_action.copy() for player_action in player_action_map.values()]
+        player_action_map[player_move.player] = validate_player_move(board, player_move, context)
 
     next_board = board.copy()
-    force_board = ForceBoard()
-
-    martyr_list = []
+    record = apply_round(next_board, player_action_map.values())
+    if heat_board is not None:
+        update_heat_board(heat_board, next_board, record.changes)
 
-    run_upgrade_phase(next_board, player_action_list)
-    run_defend_phase(next_board, player_action_list, force_board)
-    martyr_list += run_clash_phase(next_board, player_action_list, force_board)
-    martyr_list += run_battle_phase(next_board, player_action_list, force_board)
-    run_recall_phase(next_board, player_action_list)
-    run_recruit_phase(next_board, player_action_list)
+    return next_board, player_action_map, record.martyr_list
 
-    return next_board, player_action_map, martyr_list
+def apply_round(board, player_actions):
+    player_bucket_list = [
+        (player_action.player, player_action.bucket_actions()) for player_action in player_actions]
+    force_board = ForceBoard()
+    record = RoundRecord(board.mask_state())
 
-def run_upgrade_phase(board, player_action_list):
-    for player_action in player_action_list:
-        for action in player_action.extract_actions(lambda a: a.type == ActionType.Upgrade):
-            unit = board.at(action.move.position_from)
+    outer_journal = board.journal
+    board.journal = record.changes
+    try:
+        run_upgrade_phase(board, player_bucket_list)
+        run_defend_phase(board, player_bucket_list, force_board)
+        record.martyr_list += run_clash_phase(board, player_bucket_list, force_board)
+        record.martyr_list += run_battle_phase(board, player_bucket_list, force_board)
+        run_recall_phase(board, player_bucket_list)
+        run_recruit_phase(board, player_bucket_list)
+    finally:
+        board.journal = outer_journal
+        if outer_journal is not None:
+            outer_journal.extend(record.changes)
+
+    return record
+
+# puts back the first journaled unit of every written square and the masks saved
+# before the round, without re-tracking units or cloning the board; apply + undo
+# costs about as much as copy + apply_round, so either serves lookahead
+def undo_round(board, record):
+    restored = {}
+    for square, unit in record.changes:
+        if square not in restored:
+            restored[square] = unit
+    board.rewind(restored, record.mask_state)
+
+def run_upgrade_phase(board, player_bucket_list):
+    for _, buckets in player_bucket_list:
+        for action in buckets[ActionType.Upgrade]:
+            unit = board.at(action.move.square_from)
             skill = action.move.get_skill()
             if unit.is_promotion_ready():
                 promoted = unit.get_promoted(skill)
                 assert(promoted is not None)
-                board.put(action.move.position_from, promoted)
+                board.put(action.move.square_from, promoted)
             else:
-                assert(unit.endow(skill))
-
-def run_defend_phase(board, player_action_list, force_board):
-    for player_action in player_action_list:
-        for action in player_action.extract_actions(lambda a: a.type == ActionType.Defend):
-            unit = board.at(action.move.position_from)
+                upgraded = unit.endow(skill)
+                assert(upgraded is not None)
+                board.put(action.move.square_from, upgraded)
+
+def run_defend_phase(board, player_bucket_list, force_board):
+    for player, buckets in player_bucket_list:
+        for action in buckets[ActionType.Defend]:
+            unit = board.at(action.move.square_from)
             force_board.reinforce(
-                action.move.position_to,
-                player_action.player,
-                BoardUnit(unit, action.move.position_from))
+                action.move.square_to,
+                player,
+                BoardUnit(unit, action.move.square_from))
 
-def run_clash_phase(board, player_action_list, force_board):
-    clash_board = Board()
+def run_clash_phase(board, player_bucket_list, force_board):
+    clash_board = {}
     clashing_actions = []
     martyr_list = []
-    for player_action in player_action_list:
-        for action in player_action.action_list:
-            if action.type != ActionType.Attack:
-                continue
-            action_other = clash_board.at(action.move.position_to)
+    for player, buckets in player_bucket_list:
+        for action in buckets[ActionType.Attack]:
+            action_other = clash_board.get(action.move.square_to)
             if action_other is not None:
-                if action_other.move.position_to == action.move.position_from:
-                    if player_action.player == player_1:
+                if action_other.move.square_to == action.move.square_from:
+                    if player == player_1:
                         clashing_actions.extend([action, action_other])
                     else:
                         clashing_actions.extend([action_other, action])
-            clash_board.put(action.move.position_from, action)
+            clash_board[action.move.square_from] = action
 
     if len(clashing_actions) == 0:
         return martyr_list
     
+    fallen = set()
     for action_1, action_2 in list(zip(clashing_actions[0::2], clashing_actions[1::2])):
-        u1 = board.at(action_1.move.position_from)
-        u2 = board.at(action_2.move.position_from)
-        bu1 = BoardUnit(u1, action_1.move.position_from)
-        bu2 = BoardUnit(u2, action_2.move.position_from)
-
-        surviver = u1.duel(u2)
-        if surviver is None:
-            board.remove(action_1.move.position_from)
-            board.remove(action_2.move.position_from)
+        u1 = board.at(action_1.move.square_from)
+        u2 = board.at(action_2.move.square_from)
+        bu1 = BoardUnit(u1, action_1.move.square_from)
+        bu2 = BoardUnit(u2, action_2.move.square_from)
+
+        outcome = duel_table[type(u1), type(u2)]
+        if outcome == 0:
+            board.remove(action_1.move.square_from)
+            board.remove(action_2.move.square_from)
             martyr_list.extend([Martyr(bu1), Martyr(bu2)])
-            for player_action in player_action_list:
-                player_action.extract_actions(lambda a: a in [action_1, action_2])
+            fallen.update([action_1, action_2])
         else:
-            action_martyr = action_2 if surviver == u1 else action_1
-            bunit_martyr = bu2 if surviver == u1 else bu1
-            board.remove(bunit_martyr.position)
+            action_martyr = action_2 if outcome > 0 else action_1
+            bunit_martyr = bu2 if outcome > 0 else bu1
+            board.remove(bunit_martyr.square)
             martyr_list.append(Martyr(bunit_martyr))
-            for player_action in player_action_list:
-                player_action.extract_actions(lambda a: a == action_martyr)
+            fallen.add(action_martyr)
+
+    for _, buckets in player_bucket_list:
+        buckets[ActionType.Attack] = [a for a in buckets[ActionType.Attack] if a not in fallen]
 
     return martyr_list
 
-def run_battle_phase(board, player_action_list, force_board):
-    for player_action in player_action_list:
-        for action in player_action.extract_actions(
-                lambda a: a.type in (ActionType.Attack, ActionType.Move)):
-            target_position = action.move.position_to
-            if force_board.arriver(target_position, player_action.player) is None:
-                unit = board.remove(action.move.position_from)
+def run_battle_phase(board, player_bucket_list, force_board):
+    for player, buckets in player_bucket_list:
+        for action in buckets[ActionType.Attack] + buckets[ActionType.Move]:
+            target_position = action.move.square_to
+            if force_board.arriver(target_position, player) is None:
+                unit = board.remove(action.move.square_from)
                 force_board.arrive(
                     target_position, 
-                    player_action.player,
-                    BoardUnit(unit, action.move.position_from))
+                    player,
+                    BoardUnit(unit, action.move.square_from))
             else:
-                unit = board.at(action.move.position_from)
+                unit = board.at(action.move.square_from)
                 force_board.reinforce(
                     target_position,
-                    player_action.player,
-                    BoardUnit(unit, action.move.position_from))
+                    player,
+                    BoardUnit(unit, action.move.square_from))
 
     martyr_list = []
-    def settle_battle(position):
-        outcome = force_board.battle(position)
+    def settle_battle(square):
+        outcome = force_board.battle(square)
         arriver = outcome.arriver_won()
         arriving_successful = arriver is not None
-        resident = board.at(position)
+        resident = board.at(square)
 
         if arriving_successful:
             bunit = arriver
-            board.put(position, bunit.unit)
+            board.put(square, bunit.unit)
         
         if outcome.is_skirmish():
             if outcome.tied():
@@ -147,98 +252,102 @@ def run_battle_phase(board, player_action_list, force_board):
             
             if arriving_successful:
                 if resident:
-                    martyr_list.append(Martyr(BoardUnit(resident, position)))
+                    martyr_list.append(Martyr(BoardUnit(resident, square)))
             else:
                 martyr_list.append(Martyr(bunit, False))
 
     force_board.iterate_battles(settle_battle)
     return martyr_list
 
-def run_recall_phase(board, player_action_list):
-    for player_action in player_action_list:
-        for action in player_action.extract_actions(lambda a: a.type == ActionType.Recall):
-            if board.at(action.move.position_from) is None:
-                recalled = board.at(action.move.position_to)
-                if recalled is not None and recalled.owner == player_action.player:
-                    board.remove(action.move.position_to)
-                    board.put(action.move.position_from, recalled)
-
-def run_recruit_phase(board, player_action_list):
-    for player_action in player_action_list:
-        for action in player_action.action_list:
-            assert(action.type == ActionType.Recruit)
-            if board.at(action.move.position_from) is None:
+def run_recall_phase(board, player_bucket_list):
+    for player, buckets in player_bucket_list:
+        for action in buckets[ActionType.Recall]:
+            if board.at(action.move.square_from) is None:
+                recalled = board.at(action.move.square_to)
+                if recalled is not None and recalled.owner == player:
+                    board.remove(action.move.square_to)
+                    board.put(action.move.square_from, recalled)
+
+def run_recruit_phase(board, player_bucket_list):
+    for player, buckets in player_bucket_list:
+        for action in buckets[ActionType.Recruit]:
+            if board.at(action.move.square_from) is None:
                 skill = action.move.get_skill()
-                unit_recruited = Unit.create_from_skill(player_action.player, skill)
-                board.put(action.move.position_from, unit_recruited)
+                unit_recruited = Unit.create_from_skill(player, skill)
+                board.put(action.move.square_from, unit_recruited)
 
 def opponent(player):
     return player_2 if player == player_1 else player_1
 
 def status(board):
-    king_1 = find_unit(board, King, player_1)
-    king_2 = find_unit(board, King, player_2)
-    if king_1 and king_2:
+    king_1 = board.king_square[player_1]
+    king_2 = board.king_square[player_2]
+    if king_1 is not None and king_2 is not None:
         return 0
-    elif king_1:
+    elif king_1 is not None:
         return 1
-    elif king_2:
+    elif king_2 is not None:
         return 2
     else:
         return 3
 
 def find_unit(board, type_, owner):
-    found_position = None
-    
-    def each(u, position):
-        nonlocal found_position
-        if type(u) == type_ and u.owner == owner:
-            found_position = position
-
-    board.iterate_units(each)
-    return found_position
+    mask = board.unit_mask(owner, type_)
+    if mask == 0:
+        return None
+    return mask.bit_length() - 1
 
 spawn_row = {
     player_1: board_size_y - 1,
     player_2: 0
 }
 
+spawn_row_mask = {
+    player: sum(1 << square for square in range(board_size) if square % board_size_y == row)
+    for player, row in spawn_row.items()
+}
+
+# standard cost by (action type, unit type, leap), the only inputs of Action.standard_cost
+standard_costs = {}
+
+# unit type recruited by each skill index, None if the skill recruits nothing
+recruit_types = []
+leap_mask = 0
+for index in range(skillset_size ** 2):
+    dx, dy = divmod(index, skillset_size)
+    skill = Skill(PositionDelta(dx - skillset_range, dy - skillset_range))
+    recruited = Unit.create_from_skill(player_1, skill)
+    recruit_types.append(None if recruited is None else type(recruited))
+    if skill.is_leap():
+        leap_mask |= 1 << index
+
 def count_unit(board, player, unit_type=None):
-    count = 0
-    def count_unit(u, _):
-        nonlocal count
-        if u.owner == player:
-            if unit_type is None or type(u) == unit_type:
-                count += 1
-    board.iterate_units(count_unit)
-    return count
-
-def is_king_side(board, player, position):
-    king_position = find_unit(board, King, player)
-    if king_position is None:
+    return popcount(board.unit_mask(player, unit_type))
+
+def is_king_side(board, player, square):
+    king_square = board.king_square[player]
+    if king_square is None:
         return False
-    king_side = reachable_positions(board, king_position)
-    return position in king_side
+    return board.reach(king_square) >> square & 1 == 1
 
-def validate_recall(board, move, player):
-    recalled = board.at(move.position_to)
+def validate_recall(board, move, player, context):
+    recalled = board.at(move.square_to)
     if recalled is None:
         raise InvalidMoveException("recalled grid is empty")
     if recalled.owner != player:
         raise InvalidMoveException("recalled unit is enemy")
 
-    heat_board = get_heat_board(board)
-    enemy_player = player_2 if recalled.owner == player_1 else player_1
+    attack_mask = context.attack_mask(opponent(recalled.owner))
 
-    if heat_board.heat(move.position_to, enemy_player) > 0:
+    if attack_mask >> move.square_to & 1:
         raise InvalidMoveException("recalled unit is under attack")
-    if heat_board.heat(move.position_from, enemy_player) > 0:
+    if attack_mask >> move.square_from & 1:
         raise InvalidMoveException("recall destination is under attack")
 
     return Action(move, ActionType.Recall, type(recalled))
 
-def validate_spawn(board, move, player):
-    if move.position_from.y != spawn_row[player]:
+def validate_spawn(board, move, player, context):
+    if move.square_from % board_size_y != spawn_row[player]:
         return InvalidMoveException("grid is empty")
     try:
         skill = move.get_skill()
@@ -247,18 +356,20 @@ def validate_spawn(board, move, player):
     unit_recruited = Unit.create_from_skill(player, skill)
     if unit_recruited is None:
         return InvalidMoveException("this skill recruits nothing")
-    if count_unit(board, player) >= max_unit_count:
+    if context.unit_count[player] >= max_unit_count:
         return InvalidMoveException("units limit exceeded")
     return Action(move, ActionType.Recruit, type(unit_recruited))
 
-def validate_move(board, move, player):
-    unit = board.at(move.position_from)
+def validate_move(board, move, player, context=None):
+    unit = board.at(move.square_from)
     if unit is None:
-        action_or_error = validate_spawn(board, move, player)
+        if context is None:
+            context = ValidationContext(board)
+        action_or_error = validate_spawn(board, move, player, context)
         if type(action_or_error) is Action:
             return action_or_error
-        elif is_king_side(board, player, move.position_from):
-            return validate_recall(board, move, player)
+        elif context.king_side[player] >> move.square_from & 1:
+            return validate_recall(board, move, player, context)
         else:
             raise InvalidMoveException(str(action_or_error))
 
@@ -276,7 +387,7 @@ def validate_move(board, move, player):
     if not unit.skillset.has(skill):
         return Action(move, ActionType.Upgrade, type(unit))
 
-    target_unit = board.at(move.position_to)
+    target_unit = board.at(move.square_to)
 
     if target_unit is None:
         return Action(move, ActionType.Move, type(unit))
@@ -286,80 +397,220 @@ def validate_move(board, move, player):
     else:
         return Action(move, ActionType.Attack, type(unit))
 
-def validate_player_move(board, player_move):
-    moves = player_move.move_list
-    position_from_list = [move.position_from for move in moves]
-    if len(set(position_from_list)) != len(moves):
+def check_single_moves(moves):
+    if len(set(move.square_from for move in moves)) != len(moves):
         raise InvalidMoveException("unit moved more than once")
 
+def validate_player_move(board, player_move, context=None):
+    moves = player_move.move_list
+    check_single_moves(moves)
+
     return PlayerAction(
         player_move.player,
         [
-            validate_move(board, move, player_move.player)
+            validate_move(board, move, player_move.player, context)
             for move in moves
         ])
 
+def validate_many(board, player_move_list, context=None):
+    if context is None:
+        context = ValidationContext(board)
+    results = []
+    for player_move in player_move_list:
+        try:
+            results.append(validate_player_move(board, player_move, context))
+        except InvalidMoveException as e:
+            results.append(e.with_traceback(None))
+    return results
+
+# legal (Action, cost) pairs of player grouped by source square, generated one
+# square at a time so samplers only pay for the squares they pick
+class LegalActions:
+    __slots__ = ('board', 'player', 'context', 'buff', 'can_recruit', 'enemy_attack', 'recallable')
+
+    def __init__(self, board, player, context=None):
+        if context is None:
+            context = ValidationContext(board)
+        self.board = board
+        self.player = player
+        self.context = context
+        self.buff = context.buff_board()
+        self.can_recruit = context.unit_count[player] < max_unit_count
+        self.enemy_attack = None
+        self.recallable = None
+
+    # own unit squares first, then the empty squares a unit can be recruited or recalled to
+    def squares(self):
+        board = self.board
+        player = self.player
+        empty_mask = ~(board.occupancy[player_1] | board.occupancy[player_2])
+        return list(squares_of(board.unit_mask(player))) + \
+            list(squares_of(empty_mask & (self.context.king_side[player] | spawn_row_mask[player])))
+
+    # (Action, cost) of one candidate returned by candidates
+    def price(self, candidate):
+        move, type_, unit_type, leap = candidate
+        action = Action(move, type_, unit_type)
+        key = (type_, unit_type, leap)
+        cost = standard_costs.get(key)
+        if cost is None:
+            cost = standard_costs[key] = action.standard_cost()
+        return action, buffed_cost(cost, self.buff.at(move.square_from), type_)
+
+    def at(self, square):
+        return [self.price(candidate) for candidate in self.candidates(square)]
+
+    # unpriced (move, type, unit type, leap) candidates acting from square
+    def candidates(self, square):
+        board = self.board
+        player = self.player
+        legal = []
+        unit = board.at(square)
+        if unit is not None:
+            targets = skill_targets[square]
+            for index in unit.ultimate_skillset().skill_indices():
+                target = targets[index]
+                if target is None:
+                    continue
+                move = Move(square, target)
+                leap = leap_mask >> index & 1 == 1
+                if not unit.skillset.mask >> index & 1:
+                    legal.append((move, ActionType.Upgrade, type(unit), leap))
+                    continue
+                other = board.at(target)
+                if other is None:
+                    legal.append((move, ActionType.Move, type(unit), leap))
+                elif other.owner == player:
+                    legal.append((move, ActionType.Defend, type(unit), leap))
+                else:
+                    legal.append((move, ActionType.Attack, type(unit), leap))
+            return legal
+
+        if self.enemy_attack is None:
+            self.enemy_attack = self.context.attack_mask(opponent(player))
+            self.recallable = [
+                own for own in squares_of(board.unit_mask(player)) if not self.enemy_attack >> own & 1]
+        recruited = set()
+        if self.can_recruit and square % board_size_y == spawn_row[player]:
+            targets = skill_targets[square]
+            for index, unit_type in enumerate(recruit_types):
+                target = targets[index]
+                if unit_type is not None and target is not None:
+                    legal.append((Move(square, target), ActionType.Recruit, unit_type, leap_mask >> index & 1 == 1))
+                    recruited.add(target)
+        if self.context.king_side[player] >> square & 1 and not self.enemy_attack >> square & 1:
+            for target in self.recallable:
+                if target not in recruited:
+                    legal.append((Move(square, target), ActionType.Recall, type(board.at(target)), False))
+        return legal
+
+# every action validate_move accepts for a single unit of player, with its buffed cost
+def legal_actions(board, player, context=None):
+    actions = LegalActions(board, player, context)
+    legal = []
+    for square in actions.squares():
+        legal.extend(actions.at(square))
+    return legal
+
 def all_reachable_positions(board, player, include_endowment=False):
     all_ = []
-    def each(u, position):
-        if u.owner != player:
-            return
+    if not include_endowment:
+        for plane in board.reach_planes(player):
+            all_.extend(squares_of(plane))
+        return all_
+
+    def each(u, square):
         all_.extend(
-            reachable_positions(board, position, include_endowment))
+            reachable_positions(board, square, include_endowment))
             
-    board.iterate_units(each)
+    board.iterate_units(each, player)
     return all_
 
-def reachable_positions(board, position, include_endowment=False):
-    unit = board.at(position)
-    
+def reachable_positions(board, square, include_endowment=False):
+    return unit_reach(board.at(square), square, include_endowment)
+
+def unit_reach(unit, square, include_endowment=False):
     if include_endowment:
         skillset = unit.ultimate_skillset()
     else:
         skillset = unit.skillset
 
-    skill_list = skillset.list_skills()
-    in_reach = [position.get_new_position(skill.delta) for skill in skill_list]
-    return [pos for pos in in_reach if pos is not None]
+    targets = skill_targets[square]
+    return [
+        targets[index] for index in skillset.skill_indices()
+        if targets[index] is not None
+    ]
 
 def get_heat_board(board):
     heat_board = HeatBoard()
     for player in [player_1, player_2]:
-        for pos in all_reachable_positions(board, player):
-            heat_board.heatup(pos, player)
+        for square in all_reachable_positions(board, player):
+            heat_board.heatup(square, player)
     return heat_board
 
+# recompute every updated heat board from scratch and compare
+check_heat = False
+
+# moves the heat of the units replaced on the squares of a board journal
+def update_heat_board(heat_board, board, changes):
+    replaced = {}
+    for square, unit in changes:
+        if square not in replaced:
+            replaced[square] = unit
+
+    for square, old in replaced.items():
+        new = board.at(square)
+        if new is old:
+            continue
+        for unit, amount in [(old, -1), (new, 1)]:
+            if unit is None:
+                continue
+            heat = heat_board.heat_map[unit.owner]
+            for target in unit_reach(unit, square):
+                heat[target] += amount
+
+    if check_heat:
+        assert(heat_board == get_heat_board(board))
+
+buff_unit_types = [Lancer, Knight, Warrior, Swordsman, Spearman]
+
 def get_buff_board(board):
-    heat = get_heat_board(board)
-    buff = Board(BuffMap)
+    attack_mask = {}
+    buff = Grid(BuffMap)
 
-    def each(unit, position):
+    def each(unit, square):
         if type(unit) == Lancer:
-            for pos in reachable_positions(board, position):
-                other = board.at(pos)
+            for target in reachable_positions(board, square):
+                other = board.at(target)
                 if other and other.owner == unit.owner:
-                    b = buff.at(pos)
+                    b = buff.at(target)
                     b.add(ActionType.Move, -1)
                     b.add(ActionType.Attack, -1)
         elif type(unit) == Knight:
-            for pos in reachable_positions(board, position):
-                other = board.at(pos)
+            for target in reachable_positions(board, square):
+                other = board.at(target)
                 if other and other.owner == unit.owner:
-                    b = buff.at(pos)
+                    b = buff.at(target)
                     b.add(ActionType.Defend, -1)
         elif type(unit) == Warrior:
-            for pos in reachable_positions(board, position):
-                other = board.at(pos)
+            for target in reachable_positions(board, square):
+                other = board.at(target)
                 if other and other.owner != unit.owner:
-                    b = buff.at(pos)
+                    b = buff.at(target)
                     b.add(ActionType.Move, 1)
         elif type(unit) == Swordsman:
-            if heat.heat(position, player_2 if unit.owner == player_1 else player_1) > 0:
-                b = buff.at(position)
+            enemy = opponent(unit.owner)
+            if enemy not in attack_mask:
+                attack_mask[enemy] = board.attack_mask(enemy)
+            if attack_mask[enemy] >> square & 1:
+                b = buff.at(square)
                 b.add(ActionType.Upgrade, -2)
         elif type(unit) == Spearman:
-            b = buff.at(position)
+            b = buff.at(square)
             b.add(ActionType.Attack, -1)
 
-    board.iterate_units(each)
+    for player in [player_1, player_2]:
+        for type_ in buff_unit_types:
+            for square in squares_of(board.unit_mask(player, type_)):
+                each(board.at(square), square)
     return buff
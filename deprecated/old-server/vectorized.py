@@ -0,0 +1,304 @@
+from const import board_size, board_size_x, board_size_y, player_1, player_2, \
+    skillset_size, skillset_range
+from entity import ActionType, Lancer, Knight, Warrior, Swordsman, Spearman, Skill, PositionDelta
+from board import Board, Grid, HeatBoard, BuffMap
+from rule import BoardUnit, Martyr, recruit_types
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+
+players = [player_1, player_2]
+# plane groups: every unit, then the unit types whose reach gives buffs
+reach_groups = [None, Lancer, Knight, Warrior]
+mask_bytes = (board_size + 7) // 8
+
+def unpack(masks):
+    data = b''.join(mask.to_bytes(mask_bytes, 'little') for mask in masks)
+    bits = np.unpackbits(
+        np.frombuffer(data, dtype=np.uint8).reshape(-1, mask_bytes),
+        axis=1, bitorder='little')
+    return bits[:, :board_size].reshape(-1, board_size_x, board_size_y).astype(np.int16)
+
+def skill_planes(boards):
+    return unpack([
+        plane for board in boards for player in players for plane in board.skill_planes[player]
+    ]).reshape(len(boards), len(players), skillset_size ** 2, board_size_x, board_size_y)
+
+def unit_planes(boards, type_=None):
+    return unpack([
+        board.unit_mask(player, type_) for board in boards for player in players
+    ]).reshape(len(boards), len(players), board_size)
+
+def grouped_skill_planes(boards):
+    planes = skill_planes(boards)
+    groups = [planes]
+    for type_ in reach_groups[1:]:
+        type_planes = unit_planes(boards, type_).reshape(
+            len(boards), len(players), 1, board_size_x, board_size_y)
+        groups.append(planes * type_planes)
+    return np.stack(groups, axis=2)
+
+def reach_counts(planes):
+    padded = np.zeros(
+        planes.shape[:-3] + (board_size_x + 2 * skillset_range, board_size_y + 2 * skillset_range),
+        dtype=np.int16)
+    for index in range(skillset_size ** 2):
+        x, y = divmod(index, skillset_size)
+        padded[..., x:x + board_size_x, y:y + board_size_y] += planes[..., index, :, :]
+    return padded[
+        ..., 
+        skillset_range:skillset_range + board_size_x, 
+        skillset_range:skillset_range + board_size_y
+    ].reshape(planes.shape[:-3] + (board_size,))
+
+def heat_counts(boards):
+    return reach_counts(skill_planes(boards))
+
+def buff_counts(boards):
+    reach = reach_counts(grouped_skill_planes(boards))
+    heat, lancer, knight, warrior = [reach[:, :, group] for group in range(len(reach_groups))]
+    occupied = unit_planes(boards)
+    enemy_occupied = occupied[:, ::-1]
+    swordsman = unit_planes(boards, Swordsman)
+    spearman = unit_planes(boards, Spearman)
+
+    own_lancer = (lancer * occupied).sum(axis=1)
+    return {
+        ActionType.Move: (warrior * enemy_occupied).sum(axis=1) - own_lancer,
+        ActionType.Attack: -own_lancer - spearman.sum(axis=1),
+        ActionType.Defend: -(knight * occupied).sum(axis=1),
+        ActionType.Upgrade: -2 * (swordsman * (heat[:, ::-1] > 0)).sum(axis=1)
+    }
+
+def get_heat_board(board):
+    counts = heat_counts([board])[0].tolist()
+    heat_board = HeatBoard()
+    for i, player in enumerate(players):
+        heat_board.heat_map[player] = counts[i]
+    return heat_board
+
+def get_buff_board(board):
+    counts = {type_: amounts[0].tolist() for type_, amounts in buff_counts([board]).items()}
+    buff = Grid(BuffMap)
+    for square in range(board_size):
+        buff_map = buff.at(square).map
+        for type_, amounts in counts.items():
+            buff_map[type_] = amounts[square]
+    return buff
+
+# Batched round resolution. Boards are (N, 81) arrays of unit ids and the actions of
+# all games are rows of one (M, 7) array, see encode_actions.
+
+unit_table = [None]
+unit_ids = {}
+
+def unit_id(unit):
+    if unit is None:
+        return 0
+    id_ = unit_ids.get(unit)
+    if id_ is None:
+        id_ = unit_ids[unit] = len(unit_table)
+        unit_table.append(unit)
+    return id_
+
+def unit_column(attribute):
+    return np.array([0] + [getattr(unit, attribute) for unit in unit_table[1:]], dtype=np.int32)
+
+upgrade_ids = {}
+
+def upgrade_id(id_, index):
+    key = (id_, index)
+    if key not in upgrade_ids:
+        unit = unit_table[id_]
+        dx, dy = divmod(index, skillset_size)
+        skill = Skill(PositionDelta(dx - skillset_range, dy - skillset_range))
+        if unit.is_promotion_ready():
+            upgraded = unit.get_promoted(skill)
+        else:
+            upgraded = unit.endow(skill)
+        assert(upgraded is not None)
+        upgrade_ids[key] = unit_id(upgraded)
+    return upgrade_ids[key]
+
+def recruit_ids(player):
+    return np.array([
+        0 if unit_type is None else unit_id(unit_type(player)) for unit_type in recruit_types
+    ], dtype=np.int32)
+
+col_game, col_slot, col_player, col_type, col_from, col_to, col_order = range(7)
+
+def encode_boards(boards):
+    return np.array([[unit_id(unit) for unit in board.board] for board in boards], dtype=np.int32)
+
+def decode_boards(units):
+    boards = []
+    for row in units.tolist():
+        board = Board()
+        for square, id_ in enumerate(row):
+            if id_ != 0:
+                board.put(square, unit_table[id_])
+        boards.append(board)
+    return boards
+
+def encode_actions(player_actions_list):
+    rows = []
+    for game, player_actions in enumerate(player_actions_list):
+        for slot, player_action in enumerate(player_actions):
+            for order, action in enumerate(player_action.action_list):
+                rows.append((
+                    game, slot, player_action.player, action.type.value,
+                    action.move.square_from, action.move.square_to, order))
+    return np.array(rows, dtype=np.int32).reshape(-1, 7)
+
+def skill_indices(square_from, square_to):
+    x1, y1 = np.divmod(square_from, board_size_y)
+    x2, y2 = np.divmod(square_to, board_size_y)
+    return (x2 - x1 + skillset_range) * skillset_size + y2 - y1 + skillset_range
+
+# resolves one round of every game with the phase semantics of rule.apply_round,
+# returning the next units and (game, square, unit id, has trophy) martyr rows
+def resolve_rounds(units, actions, batch_size=256):
+    next_units = []
+    martyrs = []
+    for start in range(0, len(units), batch_size):
+        stop = min(start + batch_size, len(units))
+        in_batch = (actions[:, col_game] >= start) & (actions[:, col_game] < stop)
+        batch_actions = actions[in_batch].copy()
+        batch_actions[:, col_game] -= start
+        batch_units, batch_martyrs = resolve_batch(units[start:stop], batch_actions)
+        batch_martyrs[:, 0] += start
+        next_units.append(batch_units)
+        martyrs.append(batch_martyrs)
+    if not next_units:
+        return units.copy(), np.zeros((0, 4), dtype=np.int32)
+    return np.concatenate(next_units), np.concatenate(martyrs)
+
+def resolve_batch(units, actions):
+    units = units.copy()
+    martyrs = []
+    type_ = actions[:, col_type]
+
+    def rows_of(action_type):
+        rows = actions[type_ == action_type.value]
+        return rows[:, col_game], rows[:, col_player], rows[:, col_from], rows[:, col_to], rows
+
+    def martyr(game, square, id_, has_trophy):
+        martyrs.append(np.stack([
+            game, square, id_, np.broadcast_to(np.int32(has_trophy), game.shape)], axis=1))
+
+    # upgrade: python only runs once per distinct (unit, skill)
+    game, _, square_from, square_to, _ = rows_of(ActionType.Upgrade)
+    if len(game):
+        keys = units[game, square_from] * skillset_size ** 2 + skill_indices(square_from, square_to)
+        distinct, inverse = np.unique(keys, return_inverse=True)
+        upgraded = np.array([
+            upgrade_id(key // skillset_size ** 2, key % skillset_size ** 2) for key in distinct.tolist()
+        ], dtype=np.int32)
+        units[game, square_from] = upgraded[inverse]
+
+    level = unit_column('level')
+    owner = unit_column('owner')
+    reinforcers = np.zeros((len(units), len(players), board_size), dtype=np.int32)
+
+    # defend
+    game, player, _, square_to, _ = rows_of(ActionType.Defend)
+    np.add.at(reinforcers, (game, player - 1, square_to), 1)
+
+    # clash: mutual attacks duel, every loser falls together with its attack
+    game, player, square_from, square_to, attacks = rows_of(ActionType.Attack)
+    attack_target = np.full((len(units), len(players), board_size), -1, dtype=np.int32)
+    attack_target[game, player - 1, square_from] = square_to
+    mutual = attack_target[game, 2 - player, square_to] == square_from
+    fallen = mutual & (level[units[game, square_from]] <= level[units[game, square_to]])
+    martyr(game[fallen], square_from[fallen], units[game[fallen], square_from[fallen]], True)
+    units[game[fallen], square_from[fallen]] = 0
+
+    # battle: per player and target the first of Attack then Move arrives, the rest reinforce
+    moves = rows_of(ActionType.Move)[4]
+    battle = np.concatenate([attacks[~fallen], moves])
+    kind = np.concatenate([np.zeros(len(attacks) - fallen.sum()), np.ones(len(moves))])
+    order = np.lexsort((
+        battle[:, col_order], kind, battle[:, col_to], battle[:, col_player], battle[:, col_game]))
+    battle = battle[order]
+    group = battle[:, [col_game, col_player, col_to]]
+    first = np.ones(len(battle), dtype=bool)
+    first[1:] = np.any(group[1:] != group[:-1], axis=1)
+
+    game, player, square_from, square_to = (
+        battle[:, col_game], battle[:, col_player], battle[:, col_from], battle[:, col_to])
+    np.add.at(reinforcers, (game[~first], player[~first] - 1, square_to[~first]), 1)
+    arrived = np.zeros((len(units), len(players), board_size), dtype=np.int32)
+    arrived_from = np.zeros((len(units), len(players), board_size), dtype=np.int32)
+    game, player, square_from, square_to = game[first], player[first], square_from[first], square_to[first]
+    arrived[game, player - 1, square_to] = units[game, square_from]
+    arrived_from[game, player - 1, square_to] = square_from
+    units[game, square_from] = 0
+
+    game, square = np.nonzero(np.any(arrived != 0, axis=1))
+    a1, a2 = arrived[game, 0, square], arrived[game, 1, square]
+    from_1, from_2 = arrived_from[game, 0, square], arrived_from[game, 1, square]
+    r1, r2 = reinforcers[game, 0, square], reinforcers[game, 1, square]
+    skirmish = (a1 != 0) & (a2 != 0)
+    duel = np.sign(level[a1] - level[a2])
+    winner = np.where(r1 > r2, player_1, np.where(r2 > r1, player_2,
+        np.where(~skirmish, np.where(a1 != 0, player_1, player_2),
+            np.where(duel > 0, player_1, np.where(duel < 0, player_2, 0)))))
+    winning = np.where(winner == player_1, a1, np.where(winner == player_2, a2, 0))
+    resident = units[game, square]
+    units[game[winning != 0], square[winning != 0]] = winning[winning != 0]
+
+    tied = skirmish & (winner == 0)
+    martyr(game[tied], from_1[tied], a1[tied], True)
+    martyr(game[tied], from_2[tied], a2[tied], True)
+    lost = skirmish & (winner != 0)
+    loser_1 = lost & (winner == player_2)
+    loser_2 = lost & (winner == player_1)
+    martyr(game[loser_1], from_1[loser_1], a1[loser_1], True)
+    martyr(game[loser_2], from_2[loser_2], a2[loser_2], True)
+    invader = np.where(a1 != 0, a1, a2)
+    invader_from = np.where(a1 != 0, from_1, from_2)
+    conquered = ~skirmish & (winning != 0) & (resident != 0)
+    martyr(game[conquered], square[conquered], resident[conquered], True)
+    repelled = ~skirmish & (winning == 0)
+    martyr(game[repelled], invader_from[repelled], invader[repelled], False)
+
+    # recall runs in action order, one action of every game per step
+    _, _, _, _, recalls = rows_of(ActionType.Recall)
+    recalls = recalls[np.lexsort((recalls[:, col_order], recalls[:, col_slot], recalls[:, col_game]))]
+    rank = np.arange(len(recalls))
+    if len(recalls):
+        starts = np.r_[0, np.flatnonzero(np.diff(recalls[:, col_game])) + 1]
+        rank -= np.repeat(starts, np.diff(np.r_[starts, len(recalls)]))
+    for step in range(rank.max() + 1 if len(recalls) else 0):
+        rows = recalls[rank == step]
+        game, player, square_from, square_to = (
+            rows[:, col_game], rows[:, col_player], rows[:, col_from], rows[:, col_to])
+        recalled = units[game, square_to]
+        ok = (units[game, square_from] == 0) & (recalled != 0) & (owner[recalled] == player)
+        units[game[ok], square_to[ok]] = 0
+        units[game[ok], square_from[ok]] = recalled[ok]
+
+    # recruit: spawn rows differ per player and squares per player, so no two recruits collide
+    game, player, square_from, square_to, _ = rows_of(ActionType.Recruit)
+    recruited = np.stack([recruit_ids(player_1), recruit_ids(player_2)])[
+        player - 1, skill_indices(square_from, square_to)]
+    empty = units[game, square_from] == 0
+    units[game[empty], square_from[empty]] = recruited[empty]
+
+    if not martyrs:
+        return units, np.zeros((0, 4), dtype=np.int32)
+    return units, np.concatenate(martyrs).astype(np.int32)
+
+# batched counterpart of rule.apply_round on copies of the boards,
+# returning the next boards and their martyr lists
+def apply_rounds(boards, player_actions_list, batch_size=256):
+    units, martyr_rows = resolve_rounds(
+        encode_boards(boards), encode_actions(player_actions_list), batch_size)
+    martyr_lists = [[] for _ in boards]
+    for game, square, id_, has_trophy in martyr_rows.tolist():
+        martyr_lists[game].append(Martyr(BoardUnit(unit_table[id_], square), bool(has_trophy)))
+    return decode_boards(units), martyr_lists